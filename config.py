@@ -8,6 +8,32 @@ class Config:
     OUTPUT_DIR = "output"  # 输出文件夹
     TEMPLATE_FILE = "template_report.xlsx"  # 模板文件名
 
+    # 🆕 新增：多模板注册表 - 按文件名或表头特征为原报告选择模板
+    # 每个模板只在批处理开始时加载一次并常驻内存；overrides可覆盖本配置中的配置项
+    # (字典类配置项按键合并)，例如不同模板的TEMPLATE_POSITIONS、TEST_ITEMS_MAPPING
+    # 源文件在选择模板之前读取，因此SOURCE_SHEET_NAME、SOURCE_DATA_POSITIONS以及DATA_RECOGNITION中的
+    # 读取项(sample_prefix、skip_empty_rows、auto_detect_data_end、max_data_rows、empty_rows_stop_threshold、
+    # streaming_reader、stream_batch_rows)不能覆盖，包含这些项的模板会被跳过
+    TEMPLATE_REGISTRY = {
+        "enable": True,  # False时所有报告使用TEMPLATE_FILE
+        "default": "HTRB",  # 未匹配任何规则时使用的模板
+        "templates": {
+            "HTRB": {
+                "file": TEMPLATE_FILE,
+                "filename_patterns": [r"HTRB"],  # 文件名正则（不区分大小写），任一匹配即选用
+                "header_fingerprint": [],  # 原报告必须包含的测试项名称，全部存在即选用
+                "overrides": {}
+            },
+            # 示例：
+            # "HTGB": {
+            #     "file": "template_htgb.xlsx",
+            #     "filename_patterns": [r"HTGB"],
+            #     "header_fingerprint": ["3 IGSS"],
+            #     "overrides": {"TEMPLATE_POSITIONS": {"data_start_row": 20}}
+            # },
+        }
+    }
+
     # 📊 数据源配置 - ⚠️ 根据你的Excel表结构修改
     SOURCE_SHEET_NAME = "Data"  # 原始数据表名
     TEMPLATE_SHEET_NAMES = ["HTRB 100%", "AC"]  # 模板中的表名列表
@@ -31,7 +57,11 @@ class Config:
         "sample_prefix": "P",  # 样品编号前缀 (如P1, P2中的P)
         "skip_empty_rows": True,  # 是否跳过空行
         "auto_detect_data_end": True,  # 是否自动检测数据结束
-        "max_data_rows": 100,  # 最大数据行数 (防止读取过多无效数据)
+        "max_data_rows": None,  # 最大数据行数上限，None表示不限制（读到样品块真实结尾）
+        # 🆕 新增：流式读取配置
+        "empty_rows_stop_threshold": 5,  # 连续空行达到该数量即判定数据结束（需启用auto_detect_data_end）
+        "streaming_reader": True,  # 使用流式读取器（.xlsx逐批读取，不加载整张表）
+        "stream_batch_rows": 1000,  # 每批读取的行数
         # 🆕 新增：特殊值识别
         "over_value_patterns": ["OVER", "Over", "over"],  # "Over"值的识别模式
         "treat_over_as_abnormal": True  # 是否将"Over"值视为异常
@@ -60,6 +90,26 @@ class Config:
         }
     }
 
+    # 🆕 新增：动态数据分块配置 - 替代DATA_GROUPS固定范围
+    # 样品按编号分块，每块不超过模板行容量；超出target_sheets的分块会克隆模板工作表
+    DATA_PARTITIONING = {
+        "enable": True,  # False时退回DATA_GROUPS固定范围（超出范围的样品不写入）
+        "row_capacity": None,  # 每个工作表可写入的数据行数，None表示按异常统计行自动推算
+        "clone_template_sheet": True,  # 分块超出已有工作表时克隆模板工作表
+        "clone_title_format": "{title} ({n})",  # 克隆工作表的名称格式
+        # 路由规则按顺序匹配，第一个匹配的规则生效
+        # prefixes: 限定样品前缀(如["F"])，None表示全部；range: 限定样品编号范围，None表示不限
+        "rules": [
+            {
+                "name": "group",
+                "prefixes": None,
+                "range": None,
+                "target_sheets": [1, 2],  # 依次承载第1、2个分块的模板工作表
+                "description": "按模板容量自动分块"
+            }
+        ]
+    }
+
     # 🎨 格式配置
     HIGHLIGHT_COLOR = "FFFF00"  # 黄色高亮颜色
     # 🆕 新增：Over值的特殊高亮颜色
@@ -139,16 +189,128 @@ class Config:
             "enable": False,  # 是否启用详细统计
             "by_test_item": False,  # 按测试项统计
             "by_sample": False,  # 按样品统计
-            "export_to_separate_sheet": False  # 导出到单独的工作表
+            "export_to_separate_sheet": False,  # 导出到单独的工作表
+            "sheet_name": "异常统计明细",  # 🆕 单独工作表的名称
+            "batch_rollup": True,  # 🆕 批处理结束后汇总所有文件的统计
+            "rollup_file": "abnormal_statistics_rollup.xlsx"  # 🆕 批次汇总文件名（写入输出目录）
         }
     }
 
+    # 🆕 新增：输出写入配置
+    OUTPUT_WRITING = {
+        # 输出引擎："openpyxl"完整读写模板；"xml_patch"只重新生成写入的工作表XML，
+        # 其余模板部件（样式、绘图、图片、未改动的工作表）按原始字节复制
+        "engine": "openpyxl",
+        "atomic_write": True,  # 先写同目录临时文件再原子替换，避免崩溃时留下不完整的输出文件
+        "fsync": True,  # 替换前确保临时文件已落盘
+        "compression_level": 6,  # zip压缩级别0-9：0不压缩(保存最快、文件最大)，6为zlib默认，9最小
+        "background_writer": False,  # 后台线程写入输出，使下一个文件的计算与网络写入重叠
+        "max_pending_writes": 4  # 后台写入队列上限（控制待写数据占用的内存）
+    }
+
+    # 🆕 新增：输出对比/自检配置（--compare 参考目录 待测目录 / --self-check）
+    GOLDEN_CHECK = {
+        "reference_dir": None,  # 自检的参考输出目录，None表示使用OUTPUT_DIR中已有的报告
+        "file_pattern": "processed_*.xlsx",  # 参与对比的报告文件
+        "float_tolerance": 0.0,  # 数值比较容差，0表示必须完全相等
+        "max_reported": 50  # 日志中最多列出的差异数
+    }
+
+    # 🆕 新增：输出归档配置 - 工作簿、运行汇总和本次日志顺序写入少量zip归档（减少网络共享上的小文件）
+    # 读取: python smart_processor.py --list-archive <zip> / --extract-archive <zip> [--entry 名称] [--to 目录]
+    OUTPUT_ARCHIVE = {
+        "enable": False,
+        "name_format": "batch_%Y%m%d_%H%M%S",  # 归档文件名（strftime格式），写入输出目录
+        "max_entries_per_archive": 0,  # 每个归档的最大条目数，0表示不限制
+        "max_archive_mb": 0,  # 每个归档的最大大小(MB)，0表示不限制
+        "compress": False,  # xlsx本身已压缩，默认只存储不再压缩
+        "include_log": True  # 把本次运行的日志写入归档
+    }
+
+    # 🆕 新增：读取/计算/写入流水线配置
+    # 启用后读取线程预取源文件、写入线程保存输出，与计算重叠；流水线在单进程内运行，不使用单文件隔离
+    PIPELINE = {
+        "enable": False,
+        "reader_threads": 2,  # 预取源文件的读取线程数
+        "writer_threads": 2,  # 保存输出的写入线程数
+        "queue_size": 4  # 阶段之间的队列长度（控制内存中的文件数量）
+    }
+
+    # 🆕 新增：批处理调度配置 - 处理顺序、成本估算和进度显示
+    SCHEDULING = {
+        "policy": "largest_first",  # largest_first / smallest_first / newest_first / oldest_first / name / none
+        "history_file": ".cache/timing_history.json",  # 历史耗时记录（不放在输出目录），用于估算处理成本
+        "history_size": 500,  # 保留的历史记录条数
+        "default_overhead_seconds": 0.5,  # 无历史数据时每个文件的固定开销估算
+        "default_seconds_per_mb": 2.0,  # 无历史数据时每MB源文件的耗时估算
+        "progress": True,  # 显示进度、吞吐量和预计剩余时间
+        "progress_interval_seconds": 5  # 进度日志的最小间隔（最后一个文件总会输出）
+    }
+
+    # 🆕 新增：筛查模式配置（--screen）- 只读取和判定限值，不加载模板、不生成报告
+    SCREENING = {
+        "report_file": "screening_report.xlsx",  # 筛查结果表，写入输出目录
+        "log_table": True  # 在日志中列出有异常或失败的文件/数据组
+    }
+
+    # 🆕 新增：SPC统计配置 - 处理过程中按测试项累加均值/标准差/Cpk，批次结束写入汇总
+    SPC_STATISTICS = {
+        "enable": False,
+        "summary_file": "spc_summary.xlsx"  # 写入输出目录
+    }
+
+    # 🆕 新增：复测合并配置 - 同一批次的原始测试和复测源文件合并生成一份报告
+    RETEST_MERGE = {
+        "enable": False,
+        # 从文件名（不含扩展名）提取批次名的正则，命名组lot为批次名
+        # 例: DP900N10D.xlsx 与 DP900N10D_retest.xlsx / DP900N10D-RT2.xlsx 归为批次 DP900N10D
+        "lot_pattern": r"^(?P<lot>.+?)(?:[_-](?:retest|RT)\d*)?$",
+        "policy": "latest_wins",  # 重复样品: latest_wins(取最新的源文件) / first_wins(保留最早的结果)
+        "order_by": "mtime"  # 批次内源文件的先后顺序: mtime(修改时间) / name(文件名)
+    }
+
+    # 🆕 新增：增量更新配置 - 测试进行中源文件不断追加样品时，只写入新增/变化的样品行
+    # 写入位置和样品异常状态保存在state_dir中（按输出文件路径区分），不写入输出目录
+    # 增量更新的输出总是同步写入；不能与OUTPUT_ARCHIVE同时启用，常驻服务(--serve)中不生效
+    DELTA_UPDATE = {
+        "enable": False,
+        "state_dir": ".cache/delta"  # 增量更新状态目录
+    }
+
+    # 🆕 新增：分片批处理配置（--shard / --local-shards N / --merge）
+    # 多个实例共享同一工作目录认领源文件；完成标记按文件名、大小和修改时间记录，源文件变化后会重新处理
+    # 运行汇总会累积，开始新的批次前请清空工作目录
+    SHARDING = {
+        "work_dir": "work",  # 共享工作目录（多台主机时放在共享文件系统上）
+        "worker_id": None,  # 实例标识，None表示使用"主机名-进程号"
+        "heartbeat_seconds": 30,  # 认领心跳间隔（秒）
+        "stale_after_seconds": 120,  # 认领超过该时间没有心跳即可被其它实例回收
+        "poll_seconds": 5  # 剩余文件均被其它实例认领时的等待间隔（秒）
+    }
+
+    # 🆕 新增：常驻转换服务配置（--serve）
+    SERVICE = {
+        "host": "127.0.0.1",
+        "port": 8765,
+        "unix_socket": None,  # 设置路径时改为监听Unix套接字
+        "workers": 2,  # 常驻工作进程数（每个进程预加载模板）
+        "max_concurrent": None,  # 同时处理的请求数上限，None表示等于workers
+        "queue_timeout_seconds": 30,  # 等待空闲处理槽的时间，超时返回503
+        "max_upload_mb": 50  # 上传源文件大小上限
+    }
+
     # 🚨 错误处理配置
     ERROR_HANDLING = {
         "continue_on_error": True,
         "log_detailed_errors": True,
         "create_error_report": True,
-        "backup_original": False
+        "backup_original": False,
+        # 🆕 新增：单文件隔离配置
+        "isolate_files": True,  # 每个文件在独立子进程中处理
+        "file_timeout_seconds": 300,  # 单文件处理超时（秒），None表示不限制
+        "file_memory_limit_mb": 2048,  # 单文件子进程内存上限（MB，仅POSIX生效），None表示不限制
+        "isolation_start_method": None,  # 子进程启动方式: None(可用时fork，否则spawn，如Windows) / "fork" / "spawn"
+        "error_report_file": "error_report.json"  # 错误报告文件名（写入输出目录）
     }
 
     # 🆕 新增：日志配置
@@ -1,15 +1,76 @@
 import pandas as pd
 import openpyxl
 from openpyxl.styles import PatternFill
+from openpyxl.utils import get_column_letter, column_index_from_string
+from openpyxl.writer.excel import ExcelWriter
+from openpyxl.xml.functions import tostring
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape as xml_escape
 from pathlib import Path
+from datetime import datetime, timezone
+from contextlib import contextmanager
+from itertools import chain, islice
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+from zipfile import ZipFile, ZIP_DEFLATED, ZIP_STORED
+import base64
+import copy
+import hashlib
+import io
+import json
+import argparse
 import logging
+import math
+import multiprocessing
+import os
+import pickle
+import queue
 import re
+import socket
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+import traceback
 from config import Config
 
+try:
+    import resource  # 仅POSIX可用，用于限制隔离子进程的内存
+except ImportError:
+    resource = None
+
+# 需要隔离的问题文件状态：超时、超出内存上限、子进程崩溃、源文件无法读取（损坏/截断）
+QUARANTINE_STATUSES = ("timeout", "memory", "crash", "unreadable")
+ARCHIVE_LOG_HANDLER = "output-archive-log"  # 收集本次运行日志写入输出归档的日志处理器名称
+
+# 读取源文件、选择模板之前就已使用的配置项，模板overrides不能覆盖（覆盖后不会生效）
+SOURCE_CONFIG_KEYS = ("SOURCE_DIR", "SOURCE_SHEET_NAME", "SOURCE_DATA_POSITIONS")
+SOURCE_RECOGNITION_KEYS = ("sample_prefix", "skip_empty_rows", "auto_detect_data_end", "max_data_rows",
+                           "empty_rows_stop_threshold", "streaming_reader", "stream_batch_rows")
+
+# XML修补引擎中只修改样式、保留模板原值的单元格标记
+KEEP_VALUE = object()
+
 
 class SmartReportProcessor:
     def __init__(self):
         self.config = Config()
+        self.template_registry = None
+        self.active_template = None  # 当前报告使用的模板注册项
+        self.write_plans = {}  # 未通过注册表使用模板时的写入计划缓存
+        self.output_writer = None  # 后台写入线程（启用时由批处理创建）
+        self.deferred_outputs = None  # 隔离子进程中暂存的输出，交由主进程写入
+        self.last_report_statistics = None  # 最近一个报告的详细异常统计
+        self.last_report_spc = None  # 最近一个报告的SPC累加器
+        self.last_group_counts = []  # 最近一个报告各数据组的异常数量
+        self.last_source_row = None  # 最近一次提取的最后一个样品行行号
+        self.last_read_error = None  # 最近一个报告读取源文件失败的原因
+        self.last_failure = None  # 最近一个报告处理失败的原因（用于结果消息）
+        self.last_placements = None  # 增量更新模式下记录的样品写入位置
+        self.progress = None  # 批处理进度（启用时由调度器创建）
+        self.retest_lots = {}  # 复测合并批次：主文件 -> {"lot", "files"}
         self.setup_logging()
         self.ensure_directories()
 
@@ -40,17 +101,116 @@ class SmartReportProcessor:
             self.logger.debug(f"第{i}行: {row_data}")
         self.logger.debug("=" * 50)
 
-    def read_source_data(self, file_path):
-        """读取原始数据"""
+    def read_source_data(self, file_path, source=None):
+        """读取原始数据 - source为预读取的文件内容（字节）时不再访问磁盘"""
         try:
-            df = pd.read_excel(file_path, sheet_name=self.config.SOURCE_SHEET_NAME, header=None)
+            df = pd.read_excel(io.BytesIO(source) if source is not None else file_path,
+                               sheet_name=self.config.SOURCE_SHEET_NAME, header=None)
             self.logger.info(f"成功读取源文件: {file_path}")
             self.debug_dataframe(df, f"原始数据 - {file_path.name}")
             return df
+        except MemoryError:
+            raise
         except Exception as e:
             self.logger.error(f"读取源文件失败 {file_path}: {str(e)}")
+            self.last_read_error = f"{file_path.name}: {str(e)}"
             return None
 
+    def iter_source_batches(self, file_path, source=None, resume_after=None):
+        """🆕 流式读取源数据表，按批产出(行号, 行数据)列表，不加载整张表
+
+        单元格值按pd.read_excel的规则归一化（空单元格为NaN，整数值浮点转为int），
+        保证与DataFrame路径的处理结果一致。行宽取已读到的真实行的最大长度，
+        较早产出的短行由调用方按最终宽度补齐（见pad_source_rows）。
+        resume_after为上次已处理的最后一行行号（增量更新），表头之后到该行为止的行直接跳过，不做归一化。
+        """
+        batch_rows = self.config.DATA_RECOGNITION.get('stream_batch_rows', 1000)
+        data_start_row = self.config.SOURCE_DATA_POSITIONS['data_start_row']
+        skip_end = resume_after if resume_after is not None else -1
+        workbook = openpyxl.load_workbook(io.BytesIO(source) if source is not None else file_path,
+                                          read_only=True, data_only=True, keep_links=False)
+        try:
+            sheet = workbook[self.config.SOURCE_SHEET_NAME]
+            # 与pandas一致：不信任文件中的<dimension>标记（可能已过期），按真实行数据确定宽度
+            if hasattr(sheet, 'reset_dimensions'):
+                sheet.reset_dimensions()
+            width = 0
+            rows = sheet.iter_rows(values_only=True)
+            row_index = 0
+
+            while True:
+                chunk = list(islice(rows, batch_rows))
+                if not chunk:
+                    break
+
+                batch = []
+                for values in chunk:
+                    if data_start_row <= row_index <= skip_end:
+                        row_index += 1
+                        continue
+
+                    row_data = [self.normalize_cell_value(v) for v in values]
+                    width = max(width, len(row_data))
+                    if len(row_data) < width:
+                        row_data.extend([float("nan")] * (width - len(row_data)))
+                    batch.append((row_index, row_data))
+                    row_index += 1
+
+                if batch:
+                    yield batch
+        finally:
+            workbook.close()
+
+    @staticmethod
+    def normalize_cell_value(value):
+        """归一化流式读取的单元格值，与pd.read_excel保持一致"""
+        if value is None:
+            return float("nan")
+        if isinstance(value, float) and value.is_integer():
+            return int(value)
+        return value
+
+    def read_source_stream(self, file_path, source=None, resume_after=None):
+        """🆕 流式读取原始数据 - 单次遍历返回(表头DataFrame, 测试数据行)
+
+        表头区域（数据开始行之前）构造成小DataFrame供extract_test_info使用，
+        样品数据逐批扫描直到样品块结束，内存占用与批大小相关而不是与整表大小相关。
+        指定resume_after时只返回该行之后的新增样品行（增量更新）。
+        """
+        try:
+            data_start_row = self.config.SOURCE_DATA_POSITIONS['data_start_row']
+            batches = self.iter_source_batches(file_path, source, resume_after)
+            try:
+                rows = chain.from_iterable(batches)
+                header_rows = [row_data for _, row_data in islice(rows, data_start_row)]
+                self.logger.info(f"成功流式读取源文件表头: {file_path}")
+
+                self.logger.debug(f"开始流式提取测试数据，从第{data_start_row}行开始")
+                test_data = self.collect_sample_rows(rows)
+            finally:
+                batches.close()
+
+            header_rows, test_data = self.pad_source_rows(header_rows, test_data)
+            header_df = pd.DataFrame(header_rows, dtype=object)
+            self.debug_dataframe(header_df, f"原始数据表头 - {file_path.name}")
+            return header_df, test_data
+        except MemoryError:
+            raise
+        except Exception as e:
+            self.logger.error(f"流式读取源文件失败 {file_path}: {str(e)}")
+            self.last_read_error = f"{file_path.name}: {str(e)}"
+            return None, []
+
+    @staticmethod
+    def pad_source_rows(header_rows, test_data):
+        """🆕 将表头行和样品行补齐到真实最大行宽（NaN填充），与pd.read_excel的矩形结果一致"""
+        width = max((len(row) for row in chain(header_rows, test_data)), default=0)
+        padded = [
+            [row + [float("nan")] * (width - len(row)) for row in rows]
+            for rows in (header_rows, test_data)
+        ]
+        return padded[0], padded[1]
+
     def extract_test_info(self, df):
         """提取测试信息 - 使用配置的位置"""
         test_info = {}
@@ -100,65 +260,75 @@ class SmartReportProcessor:
 
         return test_info
 
+    def get_supported_prefixes(self):
+        """获取支持的样品前缀列表 - P与F前缀互相补充"""
+        sample_prefix = self.config.DATA_RECOGNITION['sample_prefix']
+        if isinstance(sample_prefix, str):
+            supported_prefixes = [sample_prefix]
+        else:
+            supported_prefixes = list(sample_prefix)
+
+        if 'P' in supported_prefixes and 'F' not in supported_prefixes:
+            supported_prefixes.append('F')
+        elif 'F' in supported_prefixes and 'P' not in supported_prefixes:
+            supported_prefixes.append('P')
+
+        return supported_prefixes
+
     def extract_test_data(self, df):
         """提取测试数据 - 支持P或F前缀"""
+        start_row = self.config.SOURCE_DATA_POSITIONS['data_start_row']
+        self.logger.debug(f"开始提取测试数据，从第{start_row}行开始")
+
+        indexed_rows = ((idx, df.iloc[idx].tolist()) for idx in range(start_row, len(df)))
+        return self.collect_sample_rows(indexed_rows)
+
+    def collect_sample_rows(self, indexed_rows):
+        """从(行号, 行数据)序列中收集样品数据行，读到样品块真实结尾为止
+
+        🆕 不再使用max_data_rows上限截断：启用auto_detect_data_end时，
+        连续空行达到empty_rows_stop_threshold即视为数据结束（或在文件末尾自然结束）。
+        """
         test_data = []
         pos = self.config.SOURCE_DATA_POSITIONS
         recognition = self.config.DATA_RECOGNITION
+        self.last_source_row = None  # 最后一个样品行的行号，供增量更新续读
 
         try:
-            self.logger.debug(f"开始提取测试数据，从第{pos['data_start_row']}行开始")
-
-            # 🆕 获取支持的前缀，支持P或F
-            sample_prefix = recognition['sample_prefix']
-            if isinstance(sample_prefix, str):
-                # 如果是单个前缀，转换为列表以支持多前缀检查
-                supported_prefixes = [sample_prefix]
-            else:
-                # 如果已经是列表，直接使用
-                supported_prefixes = sample_prefix
-
-            # 🆕 添加F前缀支持
-            if 'P' in supported_prefixes and 'F' not in supported_prefixes:
-                supported_prefixes.append('F')
-            elif 'F' in supported_prefixes and 'P' not in supported_prefixes:
-                supported_prefixes.append('P')
-            elif sample_prefix == 'P':
-                supported_prefixes = ['P', 'F']
-
+            supported_prefixes = self.get_supported_prefixes()
             self.logger.debug(f"支持的样品前缀: {supported_prefixes}")
 
-            start_row = pos['data_start_row']
-            max_rows = start_row + recognition['max_data_rows']
+            max_data_rows = recognition.get('max_data_rows')
+            empty_stop = recognition.get('empty_rows_stop_threshold', 5)
+            empty_run = 0
 
-            for idx in range(start_row, min(len(df), max_rows)):
-                row_data = df.iloc[idx].tolist()
+            for scanned, (idx, row_data) in enumerate(indexed_rows):
+                # 可选上限：仅在显式配置时生效
+                if max_data_rows and scanned >= max_data_rows:
+                    self.logger.warning(f"达到max_data_rows上限({max_data_rows})，停止数据提取")
+                    break
 
                 if len(row_data) > pos['sample_id_col']:
                     sample_id = row_data[pos['sample_id_col']]
 
-                    self.logger.debug(f"第{idx}行，样品ID: {sample_id}")
-
                     # 🆕 检查是否匹配任何支持的前缀
                     if pd.notna(sample_id):
+                        empty_run = 0
                         sample_id_str = str(sample_id).strip()
-                        is_valid_sample = False
-
-                        for prefix in supported_prefixes:
-                            if sample_id_str.startswith(prefix):
-                                is_valid_sample = True
-                                self.logger.debug(f"样品 {sample_id} 匹配前缀 {prefix}")
-                                break
 
-                        if is_valid_sample:
+                        if sample_id_str.startswith(tuple(supported_prefixes)):
                             test_data.append(row_data)
-                            self.logger.debug(f"添加测试数据行: {sample_id}")
+                            self.last_source_row = idx
+                            self.logger.debug(f"第{idx}行，添加测试数据行: {sample_id}")
 
-                    elif recognition['auto_detect_data_end'] and not pd.notna(sample_id):
-                        if recognition['skip_empty_rows']:
-                            continue
-                        else:
-                            self.logger.debug(f"遇到空行，停止数据提取")
+                    elif recognition['auto_detect_data_end']:
+                        if not recognition['skip_empty_rows']:
+                            self.logger.debug(f"第{idx}行遇到空行，停止数据提取")
+                            break
+
+                        empty_run += 1
+                        if empty_stop and empty_run >= empty_stop:
+                            self.logger.debug(f"第{idx}行连续{empty_run}个空行，判定样品数据结束")
                             break
 
             self.logger.info(f"提取到 {len(test_data)} 行测试数据")
@@ -166,6 +336,8 @@ class SmartReportProcessor:
             for i, row in enumerate(test_data[:3]):
                 self.logger.debug(f"测试数据第{i + 1}行: {row[:10]}...")
 
+        except MemoryError:
+            raise
         except Exception as e:
             self.logger.error(f"提取测试数据失败: {str(e)}")
             self.logger.exception("详细错误:")
@@ -184,7 +356,8 @@ class SmartReportProcessor:
                 'conditions': [],
                 'min_limits': [],
                 'max_limits': [],
-                'source_columns': []
+                'source_columns': [],
+                'source_conditions': []  # 每个源项的完整测试条件，与source_columns一一对应
             }
 
             self.logger.debug(f"处理模板项: {template_item}")
@@ -210,6 +383,8 @@ class SmartReportProcessor:
                     template_data[template_item]['min_limits'].append(info['min_limit'])
                     template_data[template_item]['max_limits'].append(info['max_limit'])
                     template_data[template_item]['source_columns'].append(info['column_index'])
+                    template_data[template_item]['source_conditions'].append(
+                        processing['combine_conditions_separator'].join(condition_parts))
 
                     self.logger.debug(f"  找到源项: {source_item} -> 列{info['column_index']}")
                 else:
@@ -312,22 +487,7 @@ class SmartReportProcessor:
 
             abnormal_count = 0
             sample_id_col_pos = self.config.SOURCE_DATA_POSITIONS['sample_id_col']
-            recognition = self.config.DATA_RECOGNITION
-            
-            # 获取支持的前缀，支持P或F
-            sample_prefix = recognition['sample_prefix']
-            if isinstance(sample_prefix, str):
-                supported_prefixes = [sample_prefix]
-            else:
-                supported_prefixes = sample_prefix
-            
-            # 添加F前缀支持
-            if 'P' in supported_prefixes and 'F' not in supported_prefixes:
-                supported_prefixes.append('F')
-            elif 'F' in supported_prefixes and 'P' not in supported_prefixes:
-                supported_prefixes.append('P')
-            elif sample_prefix == 'P':
-                supported_prefixes = ['P', 'F']
+            supported_prefixes = self.get_supported_prefixes()
 
             # 详细统计信息
             abnormal_samples = []
@@ -343,15 +503,9 @@ class SmartReportProcessor:
                     continue
 
                 sample_id = str(test_row[sample_id_col_pos])
-                
-                # 检查是否匹配任何支持的前缀
-                is_valid_sample = False
-                for prefix in supported_prefixes:
-                    if sample_id.strip().startswith(prefix):
-                        is_valid_sample = True
-                        break
-                
-                if not is_valid_sample:
+
+                # 🆕 与数据分组共用样品编号解析，只统计可解析的样品
+                if self.parse_sample_id(sample_id.strip(), supported_prefixes) is None:
                     continue
 
                 # 检查这一行是否有任何异常
@@ -411,6 +565,250 @@ class SmartReportProcessor:
             self.logger.error(f"统计异常数据失败: {str(e)}")
             return 0
 
+    def get_abs_limit_thresholds(self, limit_data):
+        """将测试项的多组限值合并为绝对值阈值(下限, 上限)，与is_value_abnormal的判定等价"""
+        min_values = [self.clean_numeric_value(v) for v in limit_data['min_limits'] if v is not None]
+        max_values = [self.clean_numeric_value(v) for v in limit_data['max_limits'] if v is not None]
+        min_values = [abs(v) for v in min_values if v is not None]
+        max_values = [abs(v) for v in max_values if v is not None]
+
+        # 任一下限被违反 <=> 绝对值低于最大的下限；任一上限被违反 <=> 绝对值高于最小的上限
+        return (max(min_values) if min_values else None,
+                min(max_values) if max_values else None)
+
+    def parse_value_column(self, values):
+        """向量化解析一列测试值，返回(Over掩码, 去掉单位后的绝对值)，无法解析的值为NaN"""
+        is_text = values.map(lambda v: isinstance(v, str))
+        text = values.astype(str).str.strip()
+
+        over_patterns = self.config.DATA_RECOGNITION.get('over_value_patterns', ['OVER', 'Over', 'over'])
+        over_regex = '|'.join(re.escape(pattern) for pattern in over_patterns)
+        over_mask = is_text & (text.str.contains(over_regex, regex=True) | text.str.startswith('>'))
+
+        clean_text = text
+        for unit_type, units in self.config.VALUE_PROCESSING['unit_patterns'].items():
+            for unit in units:
+                clean_text = clean_text.str.replace(unit, '', regex=False)
+        abs_values = pd.to_numeric(clean_text.str.strip(), errors='coerce').abs()
+
+        return over_mask, abs_values
+
+    def evaluate_value_column(self, values, min_threshold, max_threshold):
+        """🆕 向量化评估一列测试值，返回(Over掩码, 超限掩码)
+
+        判定规则与is_over_value/clean_numeric_value/is_value_abnormal一致：
+        Over值优先；其余值去掉单位后按绝对值与限值比较。
+        """
+        over_mask, abs_values = self.parse_value_column(values)
+
+        range_mask = pd.Series(False, index=values.index)
+        if min_threshold is not None:
+            range_mask |= abs_values < min_threshold
+        if max_threshold is not None:
+            range_mask |= abs_values > max_threshold
+
+        return over_mask, range_mask & ~over_mask
+
+    def evaluate_abnormal_cells(self, test_data, template_data):
+        """向量化评估所有样品的测试项，返回(样品编号, Over矩阵, 范围异常矩阵)，矩阵按样品行×模板测试项"""
+        sample_id_col_pos = self.config.SOURCE_DATA_POSITIONS['sample_id_col']
+        items = list(template_data.keys())
+
+        frame = pd.DataFrame(test_data, dtype=object)
+        if frame.empty or sample_id_col_pos not in frame.columns:
+            frame = pd.DataFrame(columns=[sample_id_col_pos], dtype=object)
+
+        sample_ids = frame[sample_id_col_pos].astype(str).str.strip()
+        valid_rows = sample_ids.str.startswith(tuple(self.get_supported_prefixes()))
+        frame, sample_ids = frame[valid_rows], sample_ids[valid_rows]
+
+        over = pd.DataFrame(False, index=frame.index, columns=items)
+        out_of_range = pd.DataFrame(False, index=frame.index, columns=items)
+
+        for item_name, data in template_data.items():
+            min_threshold, max_threshold = self.get_abs_limit_thresholds(data)
+            for source_col in data['source_columns']:
+                if source_col not in frame.columns:
+                    continue
+                col_over, col_range = self.evaluate_value_column(frame[source_col], min_threshold, max_threshold)
+                over[item_name] |= col_over
+                out_of_range[item_name] |= col_range
+
+        return sample_ids, over, out_of_range
+
+    def compute_abnormal_statistics(self, test_data, template_data):
+        """🆕 详细异常统计 - 一次向量化遍历得到按测试项、按样品、按异常类型的统计
+
+        与count_abnormal_data不同，同一样品的所有异常测试项都会被统计，
+        abnormal_samples（有任一异常的样品数）与count_abnormal_data的结果一致。
+        """
+        detailed = self.config.ABNORMAL_STATISTICS['detailed_statistics']
+        items = list(template_data.keys())
+        sample_ids, over, out_of_range = self.evaluate_abnormal_cells(test_data, template_data)
+
+        abnormal = over | out_of_range
+        abnormal_rows = abnormal.any(axis=1)
+
+        statistics = {
+            "samples": int(len(sample_ids)),
+            "abnormal_samples": int(abnormal_rows.sum()),
+            "over_cells": int(over.values.sum()),
+            "range_cells": int(out_of_range.values.sum())
+        }
+
+        if detailed.get('by_test_item', False):
+            statistics['by_test_item'] = {
+                item_name: {
+                    "abnormal_samples": int(abnormal[item_name].sum()),
+                    "over": int(over[item_name].sum()),
+                    "range": int(out_of_range[item_name].sum())
+                }
+                for item_name in items
+            }
+
+        if detailed.get('by_sample', False):
+            statistics['by_sample'] = {
+                sample_ids[idx]: {
+                    "over_items": [item for item in items if over.at[idx, item]],
+                    "range_items": [item for item in items if out_of_range.at[idx, item]]
+                }
+                for idx in abnormal_rows[abnormal_rows].index
+            }
+
+        self.logger.info(f"详细异常统计 - 样品: {statistics['samples']}, 异常样品: {statistics['abnormal_samples']}, "
+                         f"Over: {statistics['over_cells']}, 范围异常: {statistics['range_cells']}")
+        return statistics
+
+    def write_statistics_sheet(self, workbook, statistics):
+        """🆕 将详细异常统计导出到单独的工作表"""
+        detailed = self.config.ABNORMAL_STATISTICS['detailed_statistics']
+        sheet = workbook.create_sheet(detailed.get('sheet_name', '异常统计明细'))
+
+        sheet.append(["样品数", "异常样品数", "Over值数量", "范围异常数量"])
+        sheet.append([statistics['samples'], statistics['abnormal_samples'],
+                      statistics['over_cells'], statistics['range_cells']])
+
+        if 'by_test_item' in statistics:
+            sheet.append([])
+            sheet.append(["测试项", "异常样品数", "Over值数量", "范围异常数量"])
+            for item_name, counts in statistics['by_test_item'].items():
+                sheet.append([item_name, counts['abnormal_samples'], counts['over'], counts['range']])
+
+        if 'by_sample' in statistics:
+            sheet.append([])
+            sheet.append(["样品", "Over测试项", "范围异常测试项"])
+            separator = self.config.DATA_PROCESSING['combine_values_separator']
+            for sample_id, items in statistics['by_sample'].items():
+                sheet.append([sample_id, separator.join(items['over_items']), separator.join(items['range_items'])])
+
+        self.logger.info(f"详细异常统计已导出到工作表: {sheet.title}")
+
+    def write_statistics_rollup(self, output_dir, all_statistics):
+        """🆕 汇总整个批次的详细异常统计并写入汇总工作簿"""
+        detailed = self.config.ABNORMAL_STATISTICS['detailed_statistics']
+        columns = ["samples", "abnormal_samples", "over_cells", "range_cells"]
+
+        by_file = pd.DataFrame([{"file": st['file'], **{key: st[key] for key in columns}}
+                                for st in all_statistics], columns=["file"] + columns)
+
+        item_rows = [{"file": st['file'], "test_item": item, **counts}
+                     for st in all_statistics for item, counts in st.get('by_test_item', {}).items()]
+        sample_rows = [{"file": st['file'], "sample": sample_id,
+                        "over_items": "; ".join(items['over_items']),
+                        "range_items": "; ".join(items['range_items'])}
+                       for st in all_statistics for sample_id, items in st.get('by_sample', {}).items()]
+
+        buffer = io.BytesIO()
+        with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
+            by_file.to_excel(writer, sheet_name='按文件', index=False)
+            if item_rows:
+                by_item = (pd.DataFrame(item_rows)
+                           .groupby('test_item', sort=False)[["abnormal_samples", "over", "range"]].sum()
+                           .reset_index())
+                by_item.to_excel(writer, sheet_name='按测试项', index=False)
+                pd.DataFrame(item_rows).to_excel(writer, sheet_name='按文件及测试项', index=False)
+            if sample_rows:
+                pd.DataFrame(sample_rows).to_excel(writer, sheet_name='按样品', index=False)
+
+        rollup_path = Path(output_dir) / detailed.get('rollup_file', 'abnormal_statistics_rollup.xlsx')
+        self.atomic_write(rollup_path, buffer.getvalue())
+        self.logger.info(f"批次异常统计汇总已写入: {rollup_path} ({len(all_statistics)} 个文件, "
+                         f"异常样品合计 {int(by_file['abnormal_samples'].sum())})")
+        return rollup_path
+
+    def collect_spc_statistics(self, test_data, template_data):
+        """🆕 SPC统计 - 按测试项（测试条件和限值）累加本报告的测试值，返回可合并的累加器字典
+
+        与限值判定一致使用绝对值；Over值单独计数，不参与均值/方差。
+        """
+        sample_id_col_pos = self.config.SOURCE_DATA_POSITIONS['sample_id_col']
+        frame = pd.DataFrame(test_data, dtype=object)
+        if frame.empty or sample_id_col_pos not in frame.columns:
+            return {}
+
+        sample_ids = frame[sample_id_col_pos].astype(str).str.strip()
+        frame = frame[sample_ids.str.startswith(tuple(self.get_supported_prefixes()))]
+
+        accumulators = {}
+        for item_name, data in template_data.items():
+            for i, source_col in enumerate(data['source_columns']):
+                if source_col not in frame.columns:
+                    continue
+
+                min_limit = data['min_limits'][i] if i < len(data['min_limits']) else None
+                max_limit = data['max_limits'][i] if i < len(data['max_limits']) else None
+                lsl, usl = (self.clean_numeric_value(v) if v is not None else None for v in (min_limit, max_limit))
+                lsl, usl = (abs(v) if v is not None and not pd.isna(v) else None for v in (lsl, usl))
+                # 按源项的完整条件区分测试项（分行显示时conditions是拆开的偏置条件，不能按下标对应）
+                condition = data['source_conditions'][i]
+                limit_text = '~'.join('' if v is None or pd.isna(v) else str(v).strip() for v in (min_limit, max_limit))
+                key = f"{item_name} | {condition} | {limit_text}"
+
+                over_mask, abs_values = self.parse_value_column(frame[source_col])
+                values = abs_values[~over_mask].dropna()
+                out_of_limit = pd.Series(False, index=values.index)
+                if lsl is not None:
+                    out_of_limit |= values < lsl
+                if usl is not None:
+                    out_of_limit |= values > usl
+
+                accumulator = accumulators.setdefault(key, SpcAccumulator(item_name, condition, lsl, usl))
+                accumulator.add_values(values.tolist())
+                accumulator.over += int(over_mask.sum())
+                accumulator.out_of_limit += int(out_of_limit.sum())
+
+        return {key: accumulator.to_dict() for key, accumulator in accumulators.items()}
+
+    @staticmethod
+    def merge_spc_statistics(all_spc):
+        """合并多份SPC累加器字典，返回按测试项键合并后的累加器"""
+        merged = {}
+        for report_spc in all_spc:
+            for key, state in report_spc.items():
+                accumulator = SpcAccumulator.from_dict(state)
+                if key in merged:
+                    merged[key].merge(accumulator)
+                else:
+                    merged[key] = accumulator
+        return merged
+
+    def write_spc_summary(self, output_dir, all_spc):
+        """🆕 合并所有报告（含并行工作进程/分片）的SPC累加器并写入一份汇总"""
+        merged = self.merge_spc_statistics(all_spc)
+
+        rows = [{"test_item_key": key, **accumulator.summary()} for key, accumulator in merged.items()]
+        columns = ["test_item_key", "test_item", "condition", "lsl", "usl", "count", "mean", "std",
+                   "min", "max", "over", "out_of_limit", "cpk"]
+
+        buffer = io.BytesIO()
+        with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
+            pd.DataFrame(rows, columns=columns).to_excel(writer, sheet_name='SPC', index=False)
+
+        summary_path = Path(output_dir) / self.config.SPC_STATISTICS.get('summary_file', 'spc_summary.xlsx')
+        self.atomic_write(summary_path, buffer.getvalue())
+        self.logger.info(f"SPC统计汇总已写入: {summary_path} ({len(all_spc)} 个文件, {len(rows)} 个测试项)")
+        return summary_path
+
     def is_over_value(self, value):
         """检查是否为Over值 - 使用配置的模式"""
         try:
@@ -468,72 +866,456 @@ class SmartReportProcessor:
             self.logger.warning(f"判断异常值失败: {str(e)}")
             return False
 
-    def filter_group_test_data(self, test_data, start_sample, end_sample):
-        """筛选指定数据组的测试数据 - 支持P或F前缀"""
-        try:
-            filtered_data = []
-            recognition = self.config.DATA_RECOGNITION
-            sample_id_col_pos = self.config.SOURCE_DATA_POSITIONS['sample_id_col']
-
-            # 🆕 获取支持的前缀，支持P或F
-            sample_prefix = recognition['sample_prefix']
-            if isinstance(sample_prefix, str):
-                supported_prefixes = [sample_prefix]
-            else:
-                supported_prefixes = sample_prefix
+    def parse_sample_id(self, sample_id, supported_prefixes=None):
+        """解析样品编号，返回(前缀, 编号)，无法解析时返回None"""
+        if supported_prefixes is None:
+            supported_prefixes = self.get_supported_prefixes()
+
+        sample_id = str(sample_id)
+        for prefix in supported_prefixes:
+            if sample_id.startswith(prefix):
+                try:
+                    return prefix, int(sample_id[len(prefix):])
+                except ValueError:
+                    self.logger.warning(f"无法解析样品编号: {sample_id}")
+        return None
+
+    def get_row_capacity(self, sheet_index):
+        """获取模板工作表可容纳的数据行数 - 未配置时按异常统计行推算"""
+        capacity = self.config.DATA_PARTITIONING.get('row_capacity')
+        if capacity:
+            return capacity
+
+        position = self.config.ABNORMAL_STATISTICS.get('positions', {}).get(f"sheet_{sheet_index}")
+        if position:
+            return position['row'] - self.config.TEMPLATE_POSITIONS['data_start_row']
+        return None
+
+    def get_partition_rules(self):
+        """获取数据分块规则 - 未启用动态分块时由DATA_GROUPS固定范围生成"""
+        partitioning = self.config.DATA_PARTITIONING
+        if partitioning.get('enable', True):
+            rules = []
+            for rule in partitioning['rules']:
+                rule = dict(rule)
+                if not rule.get('row_capacity'):
+                    capacities = [c for c in (self.get_row_capacity(i) for i in rule['target_sheets']) if c]
+                    rule['row_capacity'] = min(capacities) if capacities else None
+                rule.setdefault('clone', partitioning.get('clone_template_sheet', True))
+                rules.append(rule)
+            return rules
+
+        # 兼容：DATA_GROUPS每个数据组等价于一个只有单个分块、不克隆的规则
+        rules = []
+        for group_name, group_config in self.config.DATA_GROUPS.items():
+            start_sample, end_sample = group_config['range']
+            rules.append({
+                "name": group_name,
+                "prefixes": None,
+                "range": (start_sample, end_sample),
+                "target_sheets": [group_config['target_sheet']],
+                "row_capacity": end_sample - start_sample + 1,
+                "clone": False,
+                "description": group_config.get('description', '')
+            })
+        return rules
+
+    def partition_test_data(self, test_data):
+        """🆕 单次遍历样品索引，将测试数据按规则路由并按模板行容量分块
+
+        返回数据组列表，每组包含名称、样品编号范围、目标工作表（或克隆来源）和数据行。
+        每个规则的前len(target_sheets)个分块总是生成（与原固定分组一致），
+        超出部分只有在有数据时才生成并克隆模板工作表。
+        """
+        rules = self.get_partition_rules()
+        supported_prefixes = self.get_supported_prefixes()
+        sample_id_col_pos = self.config.SOURCE_DATA_POSITIONS['sample_id_col']
+        buckets = [{} for _ in rules]
+        unmatched = 0
 
-            # 🆕 添加F前缀支持
-            if 'P' in supported_prefixes and 'F' not in supported_prefixes:
-                supported_prefixes.append('F')
-            elif 'F' in supported_prefixes and 'P' not in supported_prefixes:
-                supported_prefixes.append('P')
-            elif sample_prefix == 'P':
-                supported_prefixes = ['P', 'F']
+        for test_row in test_data:
+            if len(test_row) <= sample_id_col_pos:
+                continue
 
-            # 使用主要前缀进行范围显示
-            primary_prefix = supported_prefixes[0] if supported_prefixes else 'P'
+            parsed = self.parse_sample_id(test_row[sample_id_col_pos], supported_prefixes)
+            if parsed is None:
+                continue
+            prefix, sample_num = parsed
 
-            self.logger.debug(f"开始筛选数据组 {primary_prefix}{start_sample}-{primary_prefix}{end_sample}")
-            self.logger.debug(f"支持的前缀: {supported_prefixes}")
+            for rule_index, rule in enumerate(rules):
+                if rule.get('prefixes') and prefix not in rule['prefixes']:
+                    continue
+                range_start, range_end = rule.get('range') or (1, None)
+                if sample_num < range_start or (range_end is not None and sample_num > range_end):
+                    continue
 
-            for test_row in test_data:
-                if len(test_row) > sample_id_col_pos:
-                    sample_id = str(test_row[sample_id_col_pos])
+                capacity = rule.get('row_capacity')
+                chunk = (sample_num - range_start) // capacity if capacity else 0
+                buckets[rule_index].setdefault(chunk, []).append(test_row)
+                break
+            else:
+                unmatched += 1
+                self.logger.debug(f"样品 {test_row[sample_id_col_pos]} 未匹配任何分块规则，跳过")
+
+        if unmatched:
+            self.logger.warning(f"{unmatched} 个样品未匹配任何分块规则，未写入报告")
+
+        groups = []
+        for rule, chunks in zip(rules, buckets):
+            target_sheets = rule['target_sheets']
+            capacity = rule.get('row_capacity')
+            range_start, range_end = rule.get('range') or (1, None)
+            chunk_count = max([len(target_sheets)] + [chunk + 1 for chunk in chunks])
+
+            for chunk in range(chunk_count):
+                rows = chunks.get(chunk, [])
+                if chunk >= len(target_sheets):
+                    if not rows:
+                        continue
+                    if not rule['clone']:
+                        self.logger.warning(
+                            f"规则 {rule['name']} 第{chunk + 1}个分块有 {len(rows)} 行数据，但未启用克隆模板工作表，已跳过")
+                        continue
+
+                if capacity:
+                    chunk_start = range_start + chunk * capacity
+                    chunk_end = chunk_start + capacity - 1
+                    if range_end is not None:
+                        chunk_end = min(chunk_end, range_end)
+                else:
+                    chunk_start, chunk_end = range_start, range_end if range_end is not None else float('inf')
+
+                in_base_sheet = chunk < len(target_sheets)
+                groups.append({
+                    "name": rule['name'] if chunk_count == 1 else f"{rule['name']}{chunk + 1}",
+                    "rule": rule['name'],
+                    "range": (chunk_start, chunk_end),
+                    "target_sheet": target_sheets[chunk] if in_base_sheet else None,
+                    "clone_of": None if in_base_sheet else target_sheets[-1],
+                    "chunk": chunk,
+                    "rows": rows,
+                    "description": rule.get('description', '')
+                })
+
+        self.logger.info(f"数据分块完成: {len(groups)} 个数据组, "
+                         f"{sum(len(g['rows']) for g in groups)} 行数据")
+        return groups
+
+    def resolve_group_sheets(self, workbook, groups):
+        """为每个数据组确定目标工作表，超出模板已有工作表的分块克隆模板工作表
+
+        克隆在写入任何数据之前完成，保证克隆得到的是干净的模板工作表。
+        """
+        title_format = self.config.DATA_PARTITIONING.get('clone_title_format', "{title} ({n})")
+
+        for group in groups:
+            sheet_index = group['target_sheet'] if group['target_sheet'] is not None else group['clone_of']
+            if sheet_index >= len(workbook.worksheets):
+                self.logger.error(f"工作表索引{sheet_index}超出范围，总共{len(workbook.worksheets)}个工作表")
+                group['sheet'] = None
+                continue
+
+            # 克隆工作表沿用来源工作表的异常统计位置配置
+            group['position_index'] = sheet_index
+            source_sheet = workbook.worksheets[sheet_index]
+            if group['target_sheet'] is not None:
+                group['sheet'] = source_sheet
+            else:
+                clone = workbook.copy_worksheet(source_sheet)
+                clone.title = title_format.format(title=source_sheet.title, n=group['chunk'] + 1)[:31]
+                group['sheet'] = clone
+                self.logger.info(f"克隆模板工作表: {source_sheet.title} -> {clone.title}")
+
+    @staticmethod
+    def check_template_overrides(overrides):
+        """检查模板overrides，返回不允许覆盖的源文件读取配置项列表"""
+        rejected = [key for key in overrides if key in SOURCE_CONFIG_KEYS]
+        recognition = overrides.get('DATA_RECOGNITION', {})
+        if isinstance(recognition, dict):
+            rejected.extend(f"DATA_RECOGNITION.{key}" for key in recognition if key in SOURCE_RECOGNITION_KEYS)
+        return rejected
+
+    def compile_template_config(self, overrides):
+        """根据模板的overrides生成该模板专用的配置对象（字典类配置项按键合并）"""
+        template_config = copy.copy(self.config)
+        for key, value in overrides.items():
+            base_value = getattr(self.config, key, None)
+            if isinstance(base_value, dict) and isinstance(value, dict):
+                merged = dict(base_value)
+                merged.update(value)
+                value = merged
+            setattr(template_config, key, value)
+        return template_config
+
+    def build_template_registry(self, load_workbooks=True):
+        """🆕 编译模板注册表 - 每个模板的工作簿和位置配置只加载一次并常驻内存
+
+        模板工作簿以序列化快照保存，每份报告从快照还原一个新副本，无需重新解析xlsx。
+        load_workbooks为False时（筛查模式）只编译匹配规则和模板专用配置，不加载模板工作簿。
+        """
+        registry_config = self.config.TEMPLATE_REGISTRY
+        if registry_config.get('enable', True):
+            templates = registry_config['templates']
+        else:
+            templates = {"default": {"file": self.config.TEMPLATE_FILE}}
+
+        registry = []
+        for name, entry in templates.items():
+            template_path = Path(self.config.TEMPLATE_DIR) / entry['file']
+            rejected = self.check_template_overrides(entry.get('overrides', {}))
+            if rejected:
+                self.logger.error(f"模板 {name} 的overrides不能覆盖源文件读取配置（读取发生在选择模板之前）: "
+                                  f"{', '.join(rejected)}，已跳过该模板")
+                continue
+
+            if not load_workbooks:
+                registry.append({
+                    "name": name,
+                    "path": template_path,
+                    "patterns": [re.compile(p, re.IGNORECASE) for p in entry.get('filename_patterns', [])],
+                    "fingerprint": set(entry.get('header_fingerprint', [])),
+                    "config": self.compile_template_config(entry.get('overrides', {})),
+                    "snapshot": None,
+                    "write_plans": {}
+                })
+                continue
+
+            if not template_path.exists():
+                self.logger.error(f"模板文件不存在: {template_path} (模板 {name})")
+                continue
 
-                    # 🆕 检查是否匹配任何支持的前缀
-                    matched_prefix = None
-                    sample_num = None
-
-                    for prefix in supported_prefixes:
-                        if sample_id.startswith(prefix):
-                            matched_prefix = prefix
-                            try:
-                                # 提取样品编号
-                                sample_num_str = sample_id[len(prefix):]
-                                sample_num = int(sample_num_str)
-                                break
-                            except ValueError:
-                                self.logger.warning(f"无法解析样品编号: {sample_id}")
-                                continue
-
-                    if matched_prefix and sample_num is not None:
-                        # 🆕 检查是否在当前数据组范围内
-                        if start_sample <= sample_num <= end_sample:
-                            filtered_data.append(test_row)
-                            self.logger.debug(f"样品 {sample_id} (前缀:{matched_prefix}) 包含在数据组范围内")
-                        else:
-                            self.logger.debug(f"样品 {sample_id} 不在数据组范围内，跳过")
-                    else:
-                        self.logger.debug(f"样品 {sample_id} 不符合前缀规则，跳过")
+            try:
+                workbook = openpyxl.load_workbook(template_path)
+                template = {
+                    "name": name,
+                    "path": template_path,
+                    "patterns": [re.compile(p, re.IGNORECASE) for p in entry.get('filename_patterns', [])],
+                    "fingerprint": set(entry.get('header_fingerprint', [])),
+                    "config": self.compile_template_config(entry.get('overrides', {})),
+                    "snapshot": pickle.dumps(workbook),
+                    "write_plans": {}
+                }
+            except Exception as e:
+                self.logger.error(f"加载模板失败 {template_path}: {str(e)}")
+                continue
 
-            self.logger.info(
-                f"数据组 {primary_prefix}{start_sample}-{primary_prefix}{end_sample} 筛选完成，包含 {len(filtered_data)} 行数据")
+            # 🆕 批处理开始时一次性校验模板结构并编译写入计划
+            with self.use_template(template):
+                if self.config.VALIDATION.get('check_template_structure', True):
+                    errors = self.validate_template_structure(workbook)
+                else:
+                    errors = []
+                    for sheet_index in self.get_target_sheet_indices():
+                        self.get_write_plan(sheet_index)
+
+            if errors:
+                for error in errors:
+                    self.logger.error(f"模板结构校验失败 ({name}): {error}")
+                if self.config.VALIDATION.get('strict_mode', False):
+                    self.logger.error("严格模式下模板校验失败，停止批处理")
+                    self.template_registry = []
+                    return []
+                self.logger.error(f"模板 {name} 未通过结构校验，已跳过")
+                continue
+
+            # 🆕 XML修补引擎：模板zip在此解析一次，之后每份报告只生成目标工作表XML
+            if self.config.OUTPUT_WRITING.get('engine', 'openpyxl') == 'xml_patch':
+                with self.use_template(template):
+                    try:
+                        template['xml_package'] = XmlPatchTemplate(
+                            template_path, self.get_target_sheet_indices(),
+                            [self.get_highlight_fill(self.config.HIGHLIGHT_COLOR)],
+                            self.config.OUTPUT_WRITING.get('compression_level'))
+                    except Exception as e:
+                        self.logger.warning(f"模板 {name} 无法使用XML修补引擎，回退到openpyxl: {str(e)}")
+
+            registry.append(template)
+            self.logger.info(f"模板已加载: {name} -> {template_path} 工作表: {workbook.sheetnames}")
+
+        self.template_registry = registry
+        return registry
+
+    def get_target_sheet_indices(self):
+        """获取当前配置下所有数据组会写入的模板工作表索引"""
+        indices = []
+        for rule in self.get_partition_rules():
+            for sheet_index in rule['target_sheets']:
+                if sheet_index not in indices:
+                    indices.append(sheet_index)
+        return indices
+
+    def compile_write_plan(self, sheet_index):
+        """🆕 将模板位置配置编译为扁平写入计划
+
+        表头为(行, 列, 数据槽)列表，数据槽如('item', i)、('condition', i, j)、('min_limit', i)；
+        数据行按序号预先算好(行, 样品序号列, [(列, 测试项序号)])；异常统计单元格为(行, 列)。
+        每份报告只需按计划填值，不再重复推算坐标。
+        """
+        pos = self.config.TEMPLATE_POSITIONS
+        col_offset = pos['test_items_start_col']
+        item_count = len(self.config.TEST_ITEMS_MAPPING)
 
-            return filtered_data
+        # 测试条件不分行显示时只写入第一行，其余条件行不属于写入区域
+        condition_rows = pos['test_conditions_max_rows'] if self.config.DATA_PROCESSING['conditions_multiline'] else 1
+        header = [(pos['test_items_row'], col_offset + i, ('item', i)) for i in range(item_count)]
+        for i in range(item_count):
+            col = col_offset + i
+            for j in range(max(condition_rows, 1)):
+                header.append((pos['test_conditions_row'] + j, col, ('condition', i, j)))
+            header.append((pos['min_limit_row'], col, ('min_limit', i)))
+            header.append((pos['max_limit_row'], col, ('max_limit', i)))
+
+        abnormal_cell = None
+        position = self.config.ABNORMAL_STATISTICS.get('positions', {}).get(f"sheet_{sheet_index}")
+        if position:
+            abnormal_cell = (position.get('row', 1), position.get('col', 1))
+
+        plan = {
+            "sheet_index": sheet_index,
+            "header": header,
+            "data_rows": [],
+            "abnormal_cell": abnormal_cell,
+            "item_cols": [col_offset + i for i in range(item_count)],
+            "capacity": self.get_row_capacity(sheet_index)
+        }
+        self.extend_write_plan(plan, plan['capacity'] or 0)
+        return plan
+
+    def extend_write_plan(self, plan, row_count):
+        """确保写入计划包含至少row_count个数据行"""
+        pos = self.config.TEMPLATE_POSITIONS
+        item_slots = list(enumerate(plan['item_cols']))
+        for ordinal in range(len(plan['data_rows']), row_count):
+            plan['data_rows'].append((pos['data_start_row'] + ordinal, pos['sample_id_col'],
+                                      [(col, i) for i, col in item_slots]))
+
+    def get_plan_row(self, plan, ordinal, group_name):
+        """取写入计划的第ordinal个数据行 - 数据区容量已知时不允许越界（会覆盖异常统计行和判定公式行）"""
+        capacity = plan['capacity']
+        if capacity and ordinal >= capacity:
+            template_name = self.active_template['name'] if self.active_template else self.config.TEMPLATE_FILE
+            raise ValueError(f"模板 {template_name} 的数据组 {group_name} 超出数据区容量({capacity}行)，"
+                             f"请检查重复样品编号或DATA_PARTITIONING/DATA_GROUPS的范围配置")
+        if ordinal >= len(plan['data_rows']):
+            self.extend_write_plan(plan, ordinal + 1)
+        return plan['data_rows'][ordinal]
+
+    def get_write_plan(self, sheet_index):
+        """获取当前模板指定工作表的写入计划（首次使用时编译并缓存）"""
+        plans = self.active_template['write_plans'] if self.active_template else self.write_plans
+        if sheet_index not in plans:
+            plans[sheet_index] = self.compile_write_plan(sheet_index)
+        return plans[sheet_index]
+
+    def validate_template_structure(self, workbook):
+        """🆕 校验模板结构：目标工作表存在、写入区域没有合并单元格冲突、数据区有足够的行
+
+        返回错误信息列表，为空表示校验通过。写入合并区域中非左上角的单元格会导致每个报告都写入失败，
+        因此在批处理开始时统一检查。
+        """
+        errors = []
+        pos = self.config.TEMPLATE_POSITIONS
 
-        except Exception as e:
-            self.logger.error(f"筛选数据组数据失败: {str(e)}")
-            return []
+        for sheet_name in self.config.TEMPLATE_SHEET_NAMES:
+            if sheet_name not in workbook.sheetnames:
+                self.logger.warning(f"模板中未找到配置的工作表: {sheet_name}")
+
+        for sheet_index in self.get_target_sheet_indices():
+            if sheet_index >= len(workbook.worksheets):
+                errors.append(f"工作表索引{sheet_index}超出范围，模板只有{len(workbook.worksheets)}个工作表")
+                continue
+
+            sheet = workbook.worksheets[sheet_index]
+            plan = self.get_write_plan(sheet_index)
+
+            # 合并区域内除左上角以外的单元格不可写
+            blocked = {}
+            for merged_range in sheet.merged_cells.ranges:
+                for row in range(merged_range.min_row, merged_range.max_row + 1):
+                    for col in range(merged_range.min_col, merged_range.max_col + 1):
+                        if (row, col) != (merged_range.min_row, merged_range.min_col):
+                            blocked[(row, col)] = str(merged_range)
+
+            targets = [(row, col) for row, col, _ in plan['header']]
+            for row, sample_col, item_slots in plan['data_rows']:
+                targets.append((row, sample_col))
+                targets.extend((row, col) for col, _ in item_slots)
+            if plan['abnormal_cell']:
+                targets.append(plan['abnormal_cell'])
+
+            conflicts = sorted({(row, col, blocked[(row, col)]) for row, col in targets if (row, col) in blocked})
+            for row, col, merged_range in conflicts[:10]:
+                errors.append(f"{sheet.title}: 写入位置 行{row}, 列{col} 位于合并单元格 {merged_range} 内")
+            if len(conflicts) > 10:
+                errors.append(f"{sheet.title}: 另有 {len(conflicts) - 10} 个写入位置与合并单元格冲突")
+
+            # 数据区必须有空间，且不能覆盖异常统计单元格
+            capacity = plan['capacity']
+            if capacity is not None and capacity < 1:
+                errors.append(f"{sheet.title}: 数据区没有可用行 (数据开始行{pos['data_start_row']}, 容量{capacity})")
+            if plan['abnormal_cell'] and capacity:
+                last_data_row = pos['data_start_row'] + capacity - 1
+                if pos['data_start_row'] <= plan['abnormal_cell'][0] <= last_data_row:
+                    errors.append(f"{sheet.title}: 异常统计单元格 行{plan['abnormal_cell'][0]} 位于数据区内")
+
+            self.logger.debug(f"模板工作表 {sheet.title} 写入计划: 表头{len(plan['header'])}个单元格, "
+                              f"数据区{len(plan['data_rows'])}行")
+
+        return errors
+
+    def match_template(self, file_path, test_info):
+        """为原报告选择模板：先按文件名规则，再按表头特征，最后使用默认模板"""
+        if self.template_registry is None:
+            self.build_template_registry()
+
+        for entry in self.template_registry:
+            if any(pattern.search(file_path.name) for pattern in entry['patterns']):
+                self.logger.info(f"文件名匹配模板: {file_path.name} -> {entry['name']}")
+                return entry
+
+        source_items = set(test_info)
+        for entry in self.template_registry:
+            if entry['fingerprint'] and entry['fingerprint'] <= source_items:
+                self.logger.info(f"表头特征匹配模板: {file_path.name} -> {entry['name']}")
+                return entry
+
+        default_name = self.config.TEMPLATE_REGISTRY.get('default')
+        for entry in self.template_registry:
+            if entry['name'] == default_name or len(self.template_registry) == 1:
+                self.logger.info(f"使用默认模板: {file_path.name} -> {entry['name']}")
+                return entry
+
+        self.logger.error(f"未找到可用模板: {file_path.name}")
+        return None
+
+    @contextmanager
+    def use_template(self, entry):
+        """在处理单个报告期间切换到模板专用配置"""
+        base_config, base_template = self.config, self.active_template
+        self.config, self.active_template = entry['config'], entry
+        try:
+            yield entry
+        finally:
+            self.config, self.active_template = base_config, base_template
+
+    def open_output_workbook(self, template_path, groups):
+        """🆕 选择输出引擎：可用时使用XML修补引擎，需要克隆或新增工作表时回退到openpyxl"""
+        package = self.active_template.get('xml_package') if self.active_template else None
+        if package is not None:
+            detailed = self.config.ABNORMAL_STATISTICS['detailed_statistics']
+            needs_new_sheet = detailed.get('enable', False) and detailed.get('export_to_separate_sheet', False)
+            if not needs_new_sheet and all(group['target_sheet'] in package.sheets for group in groups):
+                return PatchWorkbook(package)
+            self.logger.debug("需要克隆或新增工作表，本报告使用openpyxl引擎")
+
+        return self.load_template_workbook(template_path)
+
+    def load_template_workbook(self, template_path):
+        """获取模板工作簿副本 - 已注册的模板从常驻快照还原"""
+        for entry in self.template_registry or []:
+            if entry['path'] == Path(template_path):
+                return pickle.loads(entry['snapshot'])
+        return openpyxl.load_workbook(template_path)
 
     def write_to_template(self, template_path, output_path, template_data, test_data):
         """写入模板并生成报告"""
@@ -541,50 +1323,132 @@ class SmartReportProcessor:
             self.logger.info(f"开始写入模板: {template_path}")
             self.logger.info(f"总测试数据行数: {len(test_data)}")
 
-            workbook = openpyxl.load_workbook(template_path)
+            # 🆕 单次遍历完成分块，再为每个分块准备工作表（必要时克隆）
+            groups = self.partition_test_data(test_data)
+            workbook = self.open_output_workbook(template_path, groups)
             self.logger.debug(f"模板工作表: {workbook.sheetnames}")
+            self.resolve_group_sheets(workbook, groups)
 
-            # 🆕 移除全局异常统计，改为分组统计
-            # abnormal_count = self.count_abnormal_data(test_data, template_data)  # 删除这行
+            # 🆕 详细异常统计（按测试项/样品/异常类型），结果保存供批次汇总使用
+            detailed = self.config.ABNORMAL_STATISTICS['detailed_statistics']
+            if detailed.get('enable', False):
+                self.last_report_statistics = self.compute_abnormal_statistics(test_data, template_data)
+                if detailed.get('export_to_separate_sheet', False):
+                    self.write_statistics_sheet(workbook, self.last_report_statistics)
 
             # 🆕 为每个数据组分别统计异常数量
-            for group_name, group_config in self.config.DATA_GROUPS.items():
-                sheet_index = group_config['target_sheet']
-                if sheet_index < len(workbook.worksheets):
-                    sheet = workbook.worksheets[sheet_index]
-                    self.logger.info(f"处理数据组: {group_name} -> 工作表{sheet_index}({sheet.title})")
-
-                    # 🆕 获取当前数据组的数据范围
-                    start_sample, end_sample = group_config['range']
-                    self.logger.info(f"数据组范围: P{start_sample}-P{end_sample}")
-
-                    # 🆕 筛选当前数据组的测试数据
-                    group_test_data = self.filter_group_test_data(test_data, start_sample, end_sample)
-                    self.logger.info(f"数据组 {group_name} 筛选出 {len(group_test_data)} 行数据")
-
-                    # 🆕 统计当前数据组的异常数量
-                    group_abnormal_count = self.count_abnormal_data(group_test_data, template_data)
-
-                    # 写入数据组数据
-                    self.write_group_data(sheet, template_data, test_data, group_config)
-
-                    # 🆕 写入当前数据组的异常统计
-                    self.write_abnormal_count(sheet, group_abnormal_count, sheet_index)
-
-                    self.logger.info(f"数据组 {group_name} 处理完成")
-                    self.logger.info(f"  - 样品范围: P{start_sample}-P{end_sample}")
-                    self.logger.info(f"  - 数据行数: {len(group_test_data)}")
-                    self.logger.info(f"  - 异常数量: {group_abnormal_count}")
-                    self.logger.info("-" * 50)
-                else:
-                    self.logger.error(f"工作表索引{sheet_index}超出范围，总共{len(workbook.worksheets)}个工作表")
+            for group in groups:
+                sheet = group['sheet']
+                if sheet is None:
+                    continue
 
-            workbook.save(output_path)
+                group_name = group['name']
+                start_sample, end_sample = group['range']
+                group_test_data = group['rows']
+                group_config = {
+                    "name": group_name,
+                    "range": group['range'],
+                    "target_sheet": group['position_index'],
+                    "description": group['description']
+                }
+                self.logger.info(f"处理数据组: {group_name} -> 工作表({sheet.title})")
+                self.logger.info(f"数据组范围: P{start_sample}-P{end_sample}")
+                self.logger.info(f"数据组 {group_name} 包含 {len(group_test_data)} 行数据")
+
+                # 🆕 统计当前数据组的异常数量
+                group_abnormal_count = self.count_abnormal_data(group_test_data, template_data)
+
+                # 写入数据组数据
+                placements = self.write_group_data(sheet, template_data, group_test_data, group_config)
+                if self.last_placements is not None:
+                    self.last_placements.append(
+                        self.build_group_placement(group, sheet, placements, template_data))
+
+                # 🆕 写入当前数据组的异常统计
+                self.write_abnormal_count(sheet, group_abnormal_count, group['position_index'])
+                self.last_group_counts.append({
+                    "group": group_name,
+                    "sheet": sheet.title,
+                    "samples": len(group_test_data),
+                    "abnormal_count": group_abnormal_count
+                })
+
+                self.logger.info(f"数据组 {group_name} 处理完成")
+                self.logger.info(f"  - 样品范围: P{start_sample}-P{end_sample}")
+                self.logger.info(f"  - 数据行数: {len(group_test_data)}")
+                self.logger.info(f"  - 异常数量: {group_abnormal_count}")
+                self.logger.info("-" * 50)
+
+            self.save_workbook(workbook, output_path)
             self.logger.info(f"成功生成报告: {output_path}")
+            return True
 
+        except MemoryError:
+            raise
         except Exception as e:
             self.logger.error(f"写入模板失败: {str(e)}")
             self.logger.exception("详细错误信息:")
+            return False
+
+    def serialize_workbook(self, workbook):
+        """🆕 将工作簿序列化到内存缓冲区 - 使用配置的zip压缩级别"""
+        if isinstance(workbook, PatchWorkbook):
+            return workbook.serialize()
+
+        level = self.config.OUTPUT_WRITING.get('compression_level')
+        buffer = io.BytesIO()
+        archive = ZipFile(buffer, 'w', ZIP_STORED if level == 0 else ZIP_DEFLATED,
+                          allowZip64=True, compresslevel=level or None)
+        workbook.properties.modified = datetime.now(timezone.utc).replace(tzinfo=None)
+        ExcelWriter(workbook, archive).save()
+        return buffer.getvalue()
+
+    def atomic_write(self, output_path, data):
+        """🆕 原子写入输出文件 - 先完整写入同目录的临时文件，再替换目标文件
+
+        写入中途崩溃只会留下临时文件，不会出现不完整的processed_*.xlsx。
+        """
+        output_path = Path(output_path)
+        output_writing = self.config.OUTPUT_WRITING
+
+        if not output_writing.get('atomic_write', True):
+            with open(output_path, 'wb') as f:
+                f.write(data)
+            return
+
+        temp_path = output_path.with_name(f".{output_path.name}.{os.getpid()}-{threading.get_ident()}.tmp")
+        try:
+            with open(temp_path, 'wb') as f:
+                f.write(data)
+                f.flush()
+                if output_writing.get('fsync', True):
+                    os.fsync(f.fileno())
+            os.replace(temp_path, output_path)
+        except BaseException:
+            if temp_path.exists():
+                temp_path.unlink()
+            raise
+
+    @contextmanager
+    def synchronous_writes(self):
+        """期间的输出直接写入磁盘，不交给后台写入线程或主进程（增量更新需要立即读取输出文件状态）"""
+        deferred_outputs, output_writer = self.deferred_outputs, self.output_writer
+        self.deferred_outputs = self.output_writer = None
+        try:
+            yield
+        finally:
+            self.deferred_outputs, self.output_writer = deferred_outputs, output_writer
+
+    def save_workbook(self, workbook, output_path):
+        """保存工作簿 - 内存序列化后原子写入，或交给后台写入线程"""
+        data = self.serialize_workbook(workbook)
+
+        if self.deferred_outputs is not None:
+            self.deferred_outputs.append((str(output_path), data))
+        elif self.output_writer is not None:
+            self.output_writer.submit(output_path, data)
+        else:
+            self.atomic_write(output_path, data)
 
     def write_abnormal_count(self, sheet, abnormal_count, sheet_index=0):
         """写入异常统计到指定位置（数值形式，不改变格式）"""
@@ -646,166 +1510,130 @@ class SmartReportProcessor:
             self.logger.error(f"写入异常统计失败: {str(e)}")
             self.logger.exception("详细错误信息:")
 
-    def write_group_data(self, sheet, template_data, test_data, group_config):
-        """写入分组数据到指定表格，支持P或F前缀"""
+    def build_header_values(self, template_data):
+        """计算表头数据槽的值：测试项目名称、测试条件（支持分行显示）、规格限值"""
         pos = self.config.TEMPLATE_POSITIONS
         processing = self.config.DATA_PROCESSING
-        recognition = self.config.DATA_RECOGNITION
-        col_offset = pos['test_items_start_col']
-
-        # 🆕 获取支持的前缀，支持P或F
-        sample_prefix = recognition['sample_prefix']
-        if isinstance(sample_prefix, str):
-            supported_prefixes = [sample_prefix]
-        else:
-            supported_prefixes = sample_prefix
-
-        # 🆕 添加F前缀支持
-        if 'P' in supported_prefixes and 'F' not in supported_prefixes:
-            supported_prefixes.append('F')
-        elif 'F' in supported_prefixes and 'P' not in supported_prefixes:
-            supported_prefixes.append('P')
-        elif sample_prefix == 'P':
-            supported_prefixes = ['P', 'F']
-
-        self.logger.debug(f"写入数据到工作表: {sheet.title}")
-        self.logger.debug(f"模板位置配置: {pos}")
-        self.logger.debug(f"数据组配置: {group_config}")
-        self.logger.debug(f"支持的前缀: {supported_prefixes}")
+        values = {}
 
-        # 写入测试项目名称
         for i, item_name in enumerate(self.config.TEST_ITEMS_MAPPING.keys()):
-            cell = sheet.cell(row=pos['test_items_row'], column=col_offset + i, value=item_name)
-            self.logger.debug(f"写入测试项目: 行{pos['test_items_row']}, 列{col_offset + i}, 值: {item_name}")
+            values[('item', i)] = item_name
 
-        # 写入测试条件，支持分行显示
         for i, (item_name, data) in enumerate(template_data.items()):
-            col = col_offset + i
-
             # 测试条件 - 支持分行显示
             if data['conditions']:
                 if processing['conditions_multiline'] and len(data['conditions']) > 1:
-                    # 分行显示测试条件
                     for j, condition in enumerate(data['conditions'][:pos['test_conditions_max_rows']]):
                         if condition:
-                            condition_row = pos['test_conditions_row'] + j
-                            sheet.cell(row=condition_row, column=col, value=condition)
-                            self.logger.debug(f"写入测试条件: 行{condition_row}, 列{col}, 值: {condition}")
+                            values[('condition', i, j)] = condition
                 else:
-                    # 单行显示所有条件
                     conditions_text = processing['combine_conditions_separator'].join(
                         [cond for cond in data['conditions'] if cond]
                     )
                     if conditions_text:
-                        sheet.cell(row=pos['test_conditions_row'], column=col, value=conditions_text)
-                        self.logger.debug(
-                            f"写入测试条件: 行{pos['test_conditions_row']}, 列{col}, 值: {conditions_text}")
+                        values[('condition', i, 0)] = conditions_text
 
             # 规格限值
-            if data['min_limits']:
-                min_vals = [str(x) for x in data['min_limits'] if x is not None and str(x).strip() != 'nan']
-                if min_vals:
-                    min_text = processing['combine_values_separator'].join(min_vals)
-                    sheet.cell(row=pos['min_limit_row'], column=col, value=min_text)
-                    self.logger.debug(f"写入最小限值: 行{pos['min_limit_row']}, 列{col}, 值: {min_text}")
-
-            if data['max_limits']:
-                max_vals = [str(x) for x in data['max_limits'] if x is not None and str(x).strip() != 'nan']
-                if max_vals:
-                    max_text = processing['combine_values_separator'].join(max_vals)
-                    sheet.cell(row=pos['max_limit_row'], column=col, value=max_text)
-                    self.logger.debug(f"写入最大限值: 行{pos['max_limit_row']}, 列{col}, 值: {max_text}")
+            for key, limits in (('min_limit', data['min_limits']), ('max_limit', data['max_limits'])):
+                limit_vals = [str(x) for x in limits if x is not None and str(x).strip() != 'nan']
+                if limit_vals:
+                    values[(key, i)] = processing['combine_values_separator'].join(limit_vals)
 
-        # 写入测试数据，支持P或F前缀
-        start_idx, end_idx = group_config['range']
-        data_row = pos['data_start_row']
+        return values
+
+    def build_data_cell(self, test_row, data):
+        """计算单个数据单元格的值，返回(写入值, 用于限值比较的数值列表)"""
+        processing = self.config.DATA_PROCESSING
+        values = []
+        numeric_values = []
+
+        for source_col in data['source_columns']:
+            if source_col < len(test_row):
+                val = test_row[source_col]
+
+                # 关键修复：使用新的有效性检查，包括0值
+                if self.is_valid_value(val):
+                    numeric_val = self.convert_to_numeric(val)
+                    if numeric_val is not None:
+                        values.append(str(numeric_val))
+                        clean_val = self.clean_numeric_value(val)
+                        if clean_val is not None:
+                            numeric_values.append(clean_val)
+
+        if values:
+            cell_value = processing['combine_values_separator'].join(values)
+        else:
+            cell_value = processing['empty_value_placeholder']
+
+        # 如果只有一个数值且启用了数值转换，直接写入数值而不是字符串（Over值保持为文本）
+        if len(values) == 1 and processing['convert_to_numeric'] and values[0] != "Over":
+            try:
+                cell_value = float(values[0])
+            except ValueError:
+                pass
+
+        return cell_value, numeric_values
+
+    def write_group_data(self, sheet, template_data, test_data, group_config):
+        """写入分组数据到指定表格 - 按预编译的写入计划填值，支持P或F前缀
+
+        返回{样品编号: 写入行号}，供增量更新记录写入位置。
+        """
+        plan = self.get_write_plan(group_config['target_sheet'])
+        supported_prefixes = self.get_supported_prefixes()
         sample_id_col_pos = self.config.SOURCE_DATA_POSITIONS['sample_id_col']
+        items = list(template_data.values())
+
+        self.logger.debug(f"写入数据到工作表: {sheet.title}, 数据组配置: {group_config}")
 
-        self.logger.debug(f"开始写入测试数据，范围: {start_idx}-{end_idx}")
+        # 表头：按计划写入有值的数据槽
+        header_values = self.build_header_values(template_data)
+        for row, col, slot in plan['header']:
+            value = header_values.get(slot)
+            if value is not None:
+                sheet.cell(row=row, column=col, value=value)
 
+        # 写入测试数据，支持P或F前缀
+        start_idx, end_idx = group_config['range']
         written_count = 0
+        placements = {}  # 样品编号 -> 写入行号
         for test_row in test_data:
-            if len(test_row) > sample_id_col_pos:
-                sample_id = str(test_row[sample_id_col_pos])
+            if len(test_row) <= sample_id_col_pos:
+                continue
 
-                # 🆕 检查是否匹配任何支持的前缀并提取编号
-                matched_prefix = None
-                p_number = None
+            parsed = self.parse_sample_id(test_row[sample_id_col_pos], supported_prefixes)
+            if parsed is None or not start_idx <= parsed[1] <= end_idx:
+                continue
 
-                for prefix in supported_prefixes:
-                    if sample_id.startswith(prefix):
-                        matched_prefix = prefix
-                        p_num = sample_id.replace(prefix, '')
-                        try:
-                            p_number = int(p_num)
-                            break
-                        except ValueError:
-                            self.logger.warning(f"无法解析样品编号: {sample_id}")
-                            continue
-
-                if matched_prefix and p_number is not None:
-                    if start_idx <= p_number <= end_idx:
-                        row_num = p_number - start_idx + 1
-                        sheet.cell(row=data_row, column=pos['sample_id_col'], value=row_num)
-                        self.logger.debug(f"写入样品{sample_id} (前缀:{matched_prefix}): 行{data_row}, 序号{row_num}")
-
-                        # 写入各测试项的数据
-                        for i, (item_name, data) in enumerate(template_data.items()):
-                            col = col_offset + i
-                            values = []
-                            numeric_values = []
-
-                            for source_col in data['source_columns']:
-                                if source_col < len(test_row):
-                                    val = test_row[source_col]
-
-                                    # 关键修复：使用新的有效性检查，包括0值
-                                    if self.is_valid_value(val):
-                                        # 转换为数值形式
-                                        numeric_val = self.convert_to_numeric(val)
-                                        if numeric_val is not None:
-                                            values.append(str(numeric_val))
-                                            # 用于限值比较的清理数值
-                                            clean_val = self.clean_numeric_value(val)
-                                            if clean_val is not None:
-                                                numeric_values.append(clean_val)
-
-                                        self.logger.debug(f"    原始值: {val}, 转换后: {numeric_val}")
-
-                            # 写入单元格值
-                            if values:
-                                cell_value = processing['combine_values_separator'].join(values)
-                            else:
-                                cell_value = processing['empty_value_placeholder']
-
-                            cell = sheet.cell(row=data_row, column=col, value=cell_value)
-
-                            # 如果只有一个数值且启用了数值转换，直接写入数值而不是字符串
-                            if (len(values) == 1 and processing['convert_to_numeric']):
-                                try:
-                                    # 修复：确保0值也能正确写入
-                                    if values[0] != "Over":  # 🆕 Over值保持为文本
-                                        numeric_cell_value = float(values[0])
-                                        cell.value = numeric_cell_value
-                                        self.logger.debug(
-                                            f"  写入数值: 行{data_row}, 列{col}, 项目{item_name}, 数值: {numeric_cell_value}")
-                                    else:
-                                        self.logger.debug(
-                                            f"  写入Over值: 行{data_row}, 列{col}, 项目{item_name}, 文本: {cell_value}")
-                                except:
-                                    self.logger.debug(
-                                        f"  写入文本: 行{data_row}, 列{col}, 项目{item_name}, 文本: {cell_value}")
-                            else:
-                                self.logger.debug(
-                                    f"  写入数据: 行{data_row}, 列{col}, 项目{item_name}, 值: {cell_value}")
-
-                            # 检查是否超出限值并高亮
-                            self.check_and_highlight(cell, numeric_values, data)
-
-                        data_row += 1
-                        written_count += 1
+            plan_row = self.get_plan_row(plan, written_count, group_config['name'])
+            self.write_sample_row(sheet, plan_row, test_row, items, parsed[1] - start_idx + 1)
+            placements[str(test_row[sample_id_col_pos]).strip()] = plan_row[0]
+
+            written_count += 1
 
         self.logger.info(f"数据组 {group_config.get('description', '')} 写入完成，共写入 {written_count} 行数据")
+        return placements
+
+    def write_sample_row(self, sheet, plan_row, test_row, items, sample_number, base_sheet=None):
+        """按写入计划的一行写入单个样品的编号和各测试项数据
+
+        base_sheet为模板工作表时（增量覆盖已有行），先恢复模板的单元格填充再重新判断高亮。
+        """
+        row, sample_col, item_slots = plan_row
+        sheet.cell(row=row, column=sample_col, value=sample_number)
+        for col, item_index in item_slots[:len(items)]:
+            data = items[item_index]
+            cell_value, numeric_values = self.build_data_cell(test_row, data)
+            cell = sheet.cell(row=row, column=col, value=cell_value)
+            if base_sheet is not None:
+                cell.fill = copy.copy(base_sheet.cell(row=row, column=col).fill)
+
+            # 检查是否超出限值并高亮
+            self.check_and_highlight(cell, numeric_values, data)
+
+    def get_highlight_fill(self, color):
+        """生成高亮填充样式"""
+        return PatternFill(start_color=color, end_color=color, fill_type="solid")
 
     def check_and_highlight(self, cell, numeric_values, limit_data):
         """检查数值是否超限并高亮显示（包括"Over"值）- 只比较绝对值大小"""
@@ -813,11 +1641,7 @@ class SmartReportProcessor:
             return
 
         try:
-            highlight_fill = PatternFill(
-                start_color=self.config.HIGHLIGHT_COLOR,
-                end_color=self.config.HIGHLIGHT_COLOR,
-                fill_type="solid"
-            )
+            highlight_fill = self.get_highlight_fill(self.config.HIGHLIGHT_COLOR)
 
             should_highlight = False
 
@@ -861,64 +1685,2268 @@ class SmartReportProcessor:
         except Exception as e:
             self.logger.warning(f"高亮检查失败: {str(e)}")
 
+    def build_group_placement(self, group, sheet, placements, template_data):
+        """记录数据组的写入位置和每个样品的异常状态（增量更新状态）"""
+        sample_id_col_pos = self.config.SOURCE_DATA_POSITIONS['sample_id_col']
+        abnormal = {str(row[sample_id_col_pos]).strip(): self.count_abnormal_data([row], template_data) > 0
+                    for row in group['rows']}
+        range_start, range_end = group['range']
+        return {
+            "key": f"{group['rule']}:{group['chunk']}",
+            "sheet": sheet.title,
+            "position_index": group['position_index'],
+            "range": [range_start, None if range_end == float('inf') else range_end],
+            "rows": {sample_id: [row, abnormal.get(sample_id, False)] for sample_id, row in placements.items()}
+        }
+
+    def get_delta_state_path(self, output_file):
+        """增量更新状态文件路径 - 放在缓存目录并按输出文件的完整路径区分，输出目录只保留报告"""
+        output_key = hashlib.sha1(str(Path(output_file).resolve()).encode('utf-8')).hexdigest()[:12]
+        state_dir = Path(self.config.DELTA_UPDATE.get('state_dir', '.cache/delta'))
+        return state_dir / f"{output_file.stem}-{output_key}.json"
+
+    def load_delta_state(self, output_file):
+        """读取增量更新状态，输出文件缺失或在状态记录之后被修改时视为无效"""
+        state_path = self.get_delta_state_path(output_file)
+        if not state_path.exists() or not output_file.exists():
+            return None
+
+        try:
+            with open(state_path, encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError) as e:
+            self.logger.warning(f"增量更新状态文件无法读取，重新生成完整报告: {str(e)}")
+            return None
+
+        output_stat = output_file.stat()
+        if [output_stat.st_size, output_stat.st_mtime_ns] != state.get('output'):
+            self.logger.info(f"输出文件已在上次增量更新后被修改，重新生成完整报告: {output_file.name}")
+            return None
+        return state
+
+    def save_delta_state(self, output_file, state):
+        """保存增量更新状态（记录输出文件当前的大小和修改时间）"""
+        output_stat = output_file.stat()
+        state['output'] = [output_stat.st_size, output_stat.st_mtime_ns]
+        state['updated_at'] = datetime.now().isoformat(timespec='seconds')
+        state_path = self.get_delta_state_path(output_file)
+        state_path.parent.mkdir(parents=True, exist_ok=True)
+        self.atomic_write(state_path, json.dumps(state, ensure_ascii=False, default=str).encode('utf-8'))
+
+    @staticmethod
+    def build_delta_signature(template_data):
+        """表头签名（测试项、条件和限值），空单元格统一视为None，避免保存方式不同导致误判变化"""
+        def normalize(value):
+            if isinstance(value, dict):
+                return {k: normalize(v) for k, v in value.items()}
+            if isinstance(value, list):
+                return [normalize(v) for v in value]
+            if value == '' or (isinstance(value, float) and math.isnan(value)):
+                return None
+            return value
+
+        return json.dumps(normalize(template_data), sort_keys=True, ensure_ascii=False, default=str)
+
+    def process_report_delta(self, file_path, output_dir, source=None):
+        """🆕 增量更新 - 只解析源文件中上次处理之后新增的样品行，并就地更新已有输出
+
+        新样品追加到对应数据组的下一个空行，已写入过的样品覆盖原行，随后按各样品的异常状态重算异常数量。
+        首次处理、表头（测试项/限值）或模板变化、需要新增克隆工作表、输出文件被外部修改时回退为完整生成。
+        输出始终同步写入（不经过后台写入线程），保证记录状态时输出文件已落盘。
+        """
+        output_file = self.get_output_path(file_path, output_dir)
+        state = self.load_delta_state(output_file)
+        detailed = self.config.ABNORMAL_STATISTICS['detailed_statistics']
+        if detailed.get('enable', False):
+            # 明细统计覆盖整份报告，无法增量维护
+            state = None
+
+        resume_after = state['last_source_row'] if state else None
+        self.logger.info(f"开始{'增量' if state else '完整'}处理: {file_path.name}")
+        df, new_rows = self.read_source_stream(file_path, source, resume_after)
+        if df is None:
+            return False
+
+        test_info = self.extract_test_info(df)
+        template = self.match_template(file_path, test_info)
+        if template is None:
+            return False
+
+        with self.use_template(template):
+            template_data = self.map_to_template_items(test_info)
+            signature = self.build_delta_signature(template_data)
+
+            if state is not None and (state['template'] != template['name'] or state['signature'] != signature):
+                self.logger.info("源文件表头或模板已变化，重新生成完整报告")
+                state = None
+            elif state is not None:
+                last_source_row = self.last_source_row
+                with self.synchronous_writes():
+                    applied = self.apply_delta_rows(template, output_file, template_data, new_rows, state)
+                if applied is not None:
+                    if applied and self.config.SPC_STATISTICS.get('enable', False):
+                        self.last_report_spc = self.collect_delta_spc(file_path, source, new_rows, template_data, state)
+                    if applied:
+                        if last_source_row is not None:
+                            state['last_source_row'] = last_source_row
+                        self.save_delta_state(output_file, state)
+                    return applied
+                self.logger.info("新增样品需要新的数据组工作表，重新生成完整报告")
+
+            # 未从上次位置续读时new_rows已是全部样品行，否则需要完整重读
+            test_data = new_rows if resume_after is None else self.read_source_stream(file_path, source)[1]
+            if self.config.SPC_STATISTICS.get('enable', False):
+                self.last_report_spc = self.collect_spc_statistics(test_data, template_data)
+            self.last_placements = []
+            try:
+                with self.synchronous_writes():
+                    ok = self.write_to_template(template['path'], output_file, template_data, test_data)
+                placements = self.last_placements
+            finally:
+                self.last_placements = None
+
+        if ok:
+            self.save_delta_state(output_file, {
+                "template": template['name'],
+                "signature": signature,
+                "last_source_row": self.last_source_row,
+                "groups": placements,
+                "spc": self.last_report_spc
+            })
+            if self.last_report_statistics is not None:
+                self.last_report_statistics.update(file=file_path.name, template=template['name'])
+        return ok
+
+    def collect_delta_spc(self, file_path, source, new_rows, template_data, state):
+        """增量更新时的SPC统计 - 上次的累加器加上新增行（源文件只追加，与完整统计一致）
+
+        状态中没有累加器（上次生成时未启用SPC）时重新读取全部样品行统计。结果同时写回状态。
+        """
+        if state.get('spc') is not None:
+            new_spc = self.collect_spc_statistics(new_rows, template_data) if new_rows else {}
+            merged = self.merge_spc_statistics([state['spc'], new_spc])
+            spc = {key: accumulator.to_dict() for key, accumulator in merged.items()}
+        else:
+            spc = self.collect_spc_statistics(self.read_source_stream(file_path, source)[1], template_data)
+        state['spc'] = spc
+        return spc
+
+    def apply_delta_rows(self, template, output_file, template_data, new_rows, state):
+        """把新增样品行写入已有输出，成功返回True；需要新的数据组工作表时返回None"""
+        if not new_rows:
+            self.logger.info(f"没有新增样品，输出保持不变: {output_file.name}")
+            return True
+
+        sample_id_col_pos = self.config.SOURCE_DATA_POSITIONS['sample_id_col']
+        supported_prefixes = self.get_supported_prefixes()
+        placed_groups = {placed['key']: placed for placed in state['groups']}
+        groups = [group for group in self.partition_test_data(new_rows) if group['rows']]
+        if any(f"{group['rule']}:{group['chunk']}" not in placed_groups for group in groups):
+            return None
+
+        workbook = openpyxl.load_workbook(output_file)
+        base_workbook = None
+        items = list(template_data.values())
+        appended = overwritten = 0
+
+        for group in groups:
+            placed = placed_groups[f"{group['rule']}:{group['chunk']}"]
+            sheet = workbook[placed['sheet']]
+            plan = self.get_write_plan(placed['position_index'])
+            rows_by_number = {plan_row[0]: plan_row for plan_row in plan['data_rows']}
+
+            for test_row in group['rows']:
+                sample_id = str(test_row[sample_id_col_pos]).strip()
+                sample_number = self.parse_sample_id(sample_id, supported_prefixes)[1] - placed['range'][0] + 1
+                existing = placed['rows'].get(sample_id)
+
+                if existing is None:
+                    plan_row = self.get_plan_row(plan, len(placed['rows']), group['name'])
+                    self.write_sample_row(sheet, plan_row, test_row, items, sample_number)
+                    appended += 1
+                else:
+                    # 覆盖已有行时按模板恢复填充，避免残留旧数据的高亮
+                    if base_workbook is None:
+                        base_workbook = self.load_template_workbook(template['path'])
+                    plan_row = rows_by_number[existing[0]]
+                    self.write_sample_row(sheet, plan_row, test_row, items, sample_number,
+                                          base_workbook.worksheets[placed['position_index']])
+                    overwritten += 1
+
+                abnormal = self.count_abnormal_data([test_row], template_data) > 0
+                placed['rows'][sample_id] = [plan_row[0], abnormal]
+
+            group_abnormal_count = sum(1 for _, abnormal in placed['rows'].values() if abnormal)
+            self.write_abnormal_count(sheet, group_abnormal_count, placed['position_index'])
+            self.last_group_counts.append({
+                "group": group['name'],
+                "sheet": sheet.title,
+                "samples": len(placed['rows']),
+                "abnormal_count": group_abnormal_count
+            })
+
+        self.save_workbook(workbook, output_file)
+        self.logger.info(f"增量更新完成: {output_file.name}，新增 {appended} 行，覆盖 {overwritten} 行")
+        return True
+
+    def get_output_path(self, file_path, output_dir):
+        """获取源文件对应的输出文件路径 - 复测合并批次使用批次名"""
+        lot = self.retest_lots.get(Path(file_path))
+        stem = lot['lot'] if lot else Path(file_path).stem
+        return Path(output_dir) / f"processed_{stem}.xlsx"
+
+    def load_source_report(self, file_path, source=None):
+        """读取源文件，返回(表头DataFrame, 测试数据行)，读取失败时表头为None"""
+        # 🆕 .xlsx使用流式读取器，其它格式(.xls)回退到DataFrame读取
+        if (self.config.DATA_RECOGNITION.get('streaming_reader', True)
+                and file_path.suffix.lower() == '.xlsx'):
+            return self.read_source_stream(file_path, source)
+
+        df = self.read_source_data(file_path, source)
+        if df is None:
+            return None, []
+        return df, self.extract_test_data(df)
+
+    def process_report(self, file_path, output_dir, source=None):
+        """处理单个报告 - 读取、匹配模板、映射并写入，成功返回True
+
+        source为预读取的源文件内容（流水线模式下由读取线程提供），为None时直接读取文件。
+        """
+        self.last_report_statistics = None
+        self.last_report_spc = None
+        self.last_group_counts = []
+        self.last_read_error = None
+        self.last_failure = None
+
+        # 🆕 复测合并：同一批次的多个源文件合并生成一份报告
+        if file_path in self.retest_lots:
+            return self.process_lot_report(file_path, output_dir, source)
+
+        # 🆕 增量更新模式：只处理新增样品行
+        if self.config.DELTA_UPDATE.get('enable', False) and file_path.suffix.lower() == '.xlsx':
+            return self.process_report_delta(file_path, output_dir, source)
+
+        self.logger.info(f"开始处理: {file_path.name}")
+        df, test_data = self.load_source_report(file_path, source)
+        if df is None:
+            return False
+
+        return self.generate_report(file_path, df, test_data, output_dir)
+
+    def generate_report(self, file_path, df, test_data, output_dir):
+        """根据已读取的表头和测试数据匹配模板、映射并写入报告，成功返回True"""
+        test_info = self.extract_test_info(df)
+
+        # 🆕 按注册表选择模板，并在模板专用配置下完成映射和写入
+        template = self.match_template(file_path, test_info)
+        if template is None:
+            return False
+
+        with self.use_template(template):
+            template_data = self.map_to_template_items(test_info)
+            if self.config.SPC_STATISTICS.get('enable', False):
+                self.last_report_spc = self.collect_spc_statistics(test_data, template_data)
+            output_file = self.get_output_path(file_path, output_dir)
+            ok = self.write_to_template(template['path'], output_file, template_data, test_data)
+
+        if ok and self.last_report_statistics is not None:
+            self.last_report_statistics.update(file=file_path.name, template=template['name'])
+        return ok
+
+    def group_retest_files(self, excel_files):
+        """🆕 按文件名规则把源文件归入批次，返回每个批次的主文件（最早的源文件）列表
+
+        同一批次有多个源文件（原始测试+复测）时记录到retest_lots，处理主文件时合并整个批次。
+        """
+        merge = self.config.RETEST_MERGE
+        self.retest_lots = {}
+        if not merge.get('enable', False):
+            return excel_files
+
+        pattern = re.compile(merge['lot_pattern'], re.IGNORECASE)
+        lots = {}
+        for file_path in excel_files:
+            match = pattern.search(file_path.stem)
+            if match is None:
+                lot = file_path.stem
+            elif 'lot' in pattern.groupindex:
+                lot = match.group('lot')
+            else:
+                lot = match.group(1) if pattern.groups else match.group(0)
+            lots.setdefault(lot, []).append(file_path)
+
+        if merge.get('order_by', 'mtime') == 'name':
+            order_key = lambda f: f.name
+        else:
+            order_key = lambda f: (self.get_file_mtime(f), f.name)
+
+        lead_files = []
+        for lot, files in lots.items():
+            files = sorted(files, key=order_key)
+            if len(files) > 1:
+                self.retest_lots[files[0]] = {"lot": lot, "files": files}
+                self.logger.info(f"复测合并批次 {lot}: {[f.name for f in files]}")
+            lead_files.append(files[0])
+        return lead_files
+
+    def process_lot_report(self, file_path, output_dir, source=None):
+        """🆕 合并同一批次的多个源文件 - 按样品编号建立索引，一次生成一份报告
+
+        表头（测试项和限值）取自最早的源文件，其余源文件的测试项及其所在列必须与之一致，否则不合并；
+        重复的样品按策略取最新（latest_wins）或最早（first_wins）的结果，样品保持首次出现的位置。
+        不生成中间工作簿，也不读取之前的输出。
+        """
+        lot = self.retest_lots[file_path]
+        policy = self.config.RETEST_MERGE.get('policy', 'latest_wins')
+        sample_id_col_pos = self.config.SOURCE_DATA_POSITIONS['sample_id_col']
+        self.logger.info(f"开始合并处理批次 {lot['lot']}，共 {len(lot['files'])} 个源文件，策略: {policy}")
+
+        base_df = base_layout = None
+        merged = {}
+        for member in lot['files']:
+            df, test_data = self.load_source_report(member, source if member == file_path else None)
+            if df is None:
+                self.logger.error(f"批次 {lot['lot']} 的源文件 {member.name} 读取失败，批次未生成")
+                self.last_read_error = f"批次 {lot['lot']} 的源文件 {self.last_read_error or member.name}"
+                return False
+
+            # 测试项名称和所在列决定样品行的解析方式，布局不同的源文件不能按同一表头合并
+            layout = {name: info['column_index'] for name, info in self.extract_test_info(df).items()}
+            if base_df is None:
+                base_df, base_layout = df, layout
+            elif layout != base_layout:
+                differences = sorted(name for name in layout.keys() | base_layout.keys()
+                                     if layout.get(name) != base_layout.get(name))
+                self.last_failure = (f"批次 {lot['lot']} 的源文件 {member.name} 与 {lot['files'][0].name} "
+                                     f"的测试项布局不一致，无法合并: {differences[:10]}")
+                self.logger.error(self.last_failure)
+                return False
+
+            replaced = 0
+            for test_row in test_data:
+                sample_id = str(test_row[sample_id_col_pos]).strip()
+                if sample_id in merged:
+                    if policy == 'first_wins':
+                        continue
+                    replaced += 1
+                merged[sample_id] = test_row
+            self.logger.info(f"  {member.name}: {len(test_data)} 个样品，覆盖已有样品 {replaced} 个")
+
+        return self.generate_report(file_path, base_df, list(merged.values()), output_dir)
+
+    def run_report(self, file_path, output_dir):
+        """处理单个报告并返回结构化结果 - 根据配置在隔离子进程中执行"""
+        error_handling = self.config.ERROR_HANDLING
+        start_time = time.monotonic()
+
+        if error_handling.get('isolate_files', True):
+            result = self.run_report_isolated(file_path, output_dir)
+        else:
+            result = self.run_report_inline(file_path, output_dir)
+
+        return self.finalize_result(result, file_path, output_dir, start_time)
+
+    def run_report_inline(self, file_path, output_dir, source=None):
+        """在当前进程中处理单个报告，异常转换为结构化结果"""
+        try:
+            ok = self.process_report(file_path, output_dir, source)
+            return dict(self.report_status(ok),
+                        statistics=self.last_report_statistics if ok else None,
+                        spc=self.last_report_spc if ok else None)
+        except MemoryError:
+            return {"status": "memory", "message": "内存不足"}
+        except Exception as e:
+            self.logger.error(f"处理文件 {file_path.name} 时发生错误: {str(e)}")
+            self.logger.exception("详细错误信息:")
+            return {"status": "error", "message": str(e), "traceback": traceback.format_exc()}
+
+    def report_status(self, ok):
+        """process_report结果对应的状态和消息 - 源文件无法读取（损坏/截断）时标记为unreadable并隔离"""
+        if ok:
+            return {"status": "ok", "message": ""}
+        if self.last_read_error is not None:
+            return {"status": "unreadable", "message": f"源文件无法读取: {self.last_read_error}"}
+        return {"status": "failed", "message": self.last_failure or "处理失败，详见日志"}
+
+    def finalize_result(self, result, file_path, output_dir, start_time):
+        """补充结果中的文件信息和耗时"""
+        result['file'] = file_path.name
+        result['path'] = str(file_path)
+        result['output'] = str(self.get_output_path(file_path, output_dir))
+        result['elapsed_seconds'] = round(time.monotonic() - start_time, 3)
+        result['quarantined'] = result['status'] in QUARANTINE_STATUSES
+        if result['quarantined']:
+            self.logger.error(f"文件已隔离: {file_path.name} - {result['message']}")
+        try:
+            result['size_bytes'] = file_path.stat().st_size
+        except OSError:
+            result['size_bytes'] = 0
+
+        if self.progress is not None:
+            self.progress.update(result)
+        return result
+
+    def run_pipeline(self, excel_files, output_dir):
+        """🆕 读取/计算/写入三阶段流水线，阶段之间用有界队列连接
+
+        读取线程预取后续源文件的内容，计算阶段（当前线程）完成解析、映射、限值检查和工作簿生成，
+        写入线程把输出写回磁盘或网络共享。I/O与计算重叠，内存占用由队列长度决定。
+        流水线在当前进程中运行，不使用单文件子进程隔离。
+        """
+        pipeline = self.config.PIPELINE
+        reader_count = max(1, pipeline.get('reader_threads', 2))
+        read_queue = queue.Queue(maxsize=max(1, pipeline.get('queue_size', 4)))
+        pending_files = iter(excel_files)
+        files_lock = threading.Lock()
+        stop_event = threading.Event()
+
+        def reader():
+            while not stop_event.is_set():
+                with files_lock:
+                    file_path = next(pending_files, None)
+                if file_path is None:
+                    break
+
+                try:
+                    item = (file_path, file_path.read_bytes(), None)
+                except Exception as e:
+                    item = (file_path, None, e)
+
+                # 队列已满时阻塞，停止时放弃预取
+                while not stop_event.is_set():
+                    try:
+                        read_queue.put(item, timeout=0.5)
+                        break
+                    except queue.Full:
+                        continue
+            read_queue.put(None)
+
+        readers = [threading.Thread(target=reader, name=f"source-reader-{i}", daemon=True)
+                   for i in range(reader_count)]
+        for thread in readers:
+            thread.start()
+
+        results = []
+        finished_readers = 0
+        while finished_readers < reader_count:
+            item = read_queue.get()
+            if item is None:
+                finished_readers += 1
+                continue
+            if stop_event.is_set():
+                continue
+
+            file_path, source, read_error = item
+            start_time = time.monotonic()
+            if read_error is not None:
+                self.logger.error(f"读取源文件失败 {file_path}: {str(read_error)}")
+                result = {"status": "unreadable", "message": f"源文件无法读取: {file_path.name}: {str(read_error)}"}
+            else:
+                result = self.run_report_inline(file_path, output_dir, source)
+            results.append(self.finalize_result(result, file_path, output_dir, start_time))
+
+            if result['status'] != 'ok' and not self.config.ERROR_HANDLING['continue_on_error']:
+                stop_event.set()
+
+        for thread in readers:
+            thread.join()
+        return results
+
+    def run_report_isolated(self, file_path, output_dir):
+        """🆕 在子进程中处理单个报告，超时或超出内存上限时终止子进程
+
+        损坏或超大的源文件只会拖住自己的子进程，批处理中的其它文件不受影响。
+        """
+        error_handling = self.config.ERROR_HANDLING
+        timeout = error_handling.get('file_timeout_seconds')
+        memory_limit_mb = error_handling.get('file_memory_limit_mb')
+
+        start_method = error_handling.get('isolation_start_method')
+        if not start_method:
+            start_method = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else 'spawn'
+        context = multiprocessing.get_context(start_method)
+        parent_conn, child_conn = context.Pipe(duplex=False)
+        process = context.Process(
+            target=_isolated_report_worker,
+            args=(self.build_isolation_payload(file_path), file_path, output_dir, memory_limit_mb, child_conn),
+            daemon=True
+        )
+
+        try:
+            # 启动失败（如spawn方式下参数无法序列化）只记为该文件失败，不中断批处理
+            process.start()
+            child_conn.close()
+            if parent_conn.poll(timeout):
+                result = parent_conn.recv()
+            elif process.is_alive():
+                self.logger.error(f"处理文件 {file_path.name} 超时({timeout}秒)，终止子进程")
+                process.terminate()
+                result = {"status": "timeout", "message": f"处理超时({timeout}秒)"}
+            else:
+                result = {"status": "crash", "message": f"子进程异常退出，退出码 {process.exitcode}"}
+        except EOFError:
+            process.join(5)
+            result = {"status": "crash", "message": f"子进程异常退出，退出码 {process.exitcode}"}
+        except Exception as e:
+            self.logger.error(f"处理文件 {file_path.name} 的子进程启动或通信失败: {str(e)}")
+            self.logger.exception("详细错误信息:")
+            result = {"status": "error", "message": f"子进程启动或通信失败: {str(e)}",
+                      "traceback": traceback.format_exc()}
+        finally:
+            parent_conn.close()
+            child_conn.close()
+            if process.pid is not None:
+                process.join(5)
+            if process.pid is not None and process.is_alive():
+                process.terminate()
+                process.join(5)
+                if process.is_alive():
+                    process.kill()
+                    process.join()
+
+        # 子进程的日志写入主进程的归档日志（子进程中收集的日志不会自动回到主进程）
+        child_log = result.pop('log', '')
+        if child_log:
+            for handler in logging.getLogger().handlers:
+                if handler.get_name() == ARCHIVE_LOG_HANDLER:
+                    handler.stream.write(child_log)
+
+        # 子进程中生成的输出由主进程写入（可交给后台写入线程）
+        for output_path, data in result.pop('outputs', []):
+            if self.output_writer is not None:
+                self.output_writer.submit(output_path, data)
+            else:
+                try:
+                    self.atomic_write(output_path, data)
+                except Exception as e:
+                    self.logger.error(f"写入输出文件失败 {output_path}: {str(e)}")
+                    result = {"status": "error", "message": f"写入输出文件失败: {str(e)}"}
+        return result
+
+    def build_isolation_payload(self, file_path):
+        """隔离子进程所需的最小状态 - 配置、模板注册表、复测批次和输出方式
+
+        不传递处理器本身：后台写入线程、进度统计等运行时对象含有锁和线程，spawn方式下无法序列化，
+        子进程也不需要它们（子进程同步生成输出，启用后台写入/归档时输出回传给主进程写入）。
+        """
+        lot = self.retest_lots.get(file_path)
+        return {
+            "config": self.config,
+            "template_registry": self.template_registry,
+            "retest_lots": {file_path: lot} if lot else {},
+            "defer_outputs": self.output_writer is not None,
+            "collect_log": any(h.get_name() == ARCHIVE_LOG_HANDLER for h in logging.getLogger().handlers)
+        }
+
+    def write_error_report(self, output_dir, results):
+        """🆕 写入结构化错误报告（JSON），包含失败文件和隔离列表"""
+        error_handling = self.config.ERROR_HANDLING
+        if not error_handling.get('create_error_report', True):
+            return None
+
+        failures = [r for r in results if r['status'] != 'ok']
+        report = {
+            "generated_at": datetime.now().isoformat(timespec='seconds'),
+            "total_files": len(results),
+            "succeeded": len(results) - len(failures),
+            "failed": len(failures),
+            "quarantine": [r['path'] for r in failures if r['quarantined']],
+            "errors": failures
+        }
+        if not error_handling.get('log_detailed_errors', True):
+            for entry in report['errors']:
+                entry.pop('traceback', None)
+
+        report_path = Path(output_dir) / error_handling.get('error_report_file', 'error_report.json')
+        try:
+            with open(report_path, 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+            self.logger.info(f"错误报告已写入: {report_path} (失败 {len(failures)}, 隔离 {len(report['quarantine'])})")
+        except Exception as e:
+            self.logger.error(f"写入错误报告失败: {str(e)}")
+        return report_path
+
     def process_all_reports(self):
         """处理所有报告"""
         source_dir = Path(self.config.SOURCE_DIR)
-        template_path = Path(self.config.TEMPLATE_DIR) / self.config.TEMPLATE_FILE
         output_dir = Path(self.config.OUTPUT_DIR)
 
         self.logger.info(f"源文件目录: {source_dir}")
-        self.logger.info(f"模板文件: {template_path}")
         self.logger.info(f"输出目录: {output_dir}")
 
-        if not template_path.exists():
-            self.logger.error(f"模板文件不存在: {template_path}")
+        # 增量更新就地修改输出目录中的已有报告，与输出归档（输出不落在输出目录）不能同时启用
+        if self.config.DELTA_UPDATE.get('enable', False) and self.config.OUTPUT_ARCHIVE.get('enable', False):
+            self.logger.error("增量更新(DELTA_UPDATE)与输出归档(OUTPUT_ARCHIVE)不能同时启用，请关闭其中一项")
+            return
+
+        # 🆕 批处理开始时一次性加载所有模板
+        if not self.build_template_registry():
+            self.logger.error(f"没有可用的模板文件: {self.config.TEMPLATE_DIR}")
             return
 
-        excel_files = list(source_dir.glob("*.xlsx")) + list(source_dir.glob("*.xls"))
+        excel_files = self.list_source_files(source_dir)
 
         if not excel_files:
             self.logger.warning(f"在 {source_dir} 中未找到Excel源文件")
             return
 
         self.logger.info(f"找到 {len(excel_files)} 个Excel文件: {[f.name for f in excel_files]}")
+        excel_files = self.schedule_files(self.group_retest_files(excel_files), output_dir)
+
+        # 🆕 可选后台写入线程：当前文件写入网络共享时，下一个文件的计算同时进行
+        output_writing = self.config.OUTPUT_WRITING
+        pipeline = self.config.PIPELINE
+        archive, log_handler = self.open_output_archive(output_dir)
+        if archive is not None:
+            # 归档模式：所有输出由单个写入线程顺序写入归档
+            self.output_writer = BackgroundOutputWriter(
+                archive.write_output, output_writing.get('max_pending_writes', 4), self.logger)
+        elif pipeline.get('enable', False):
+            self.output_writer = BackgroundOutputWriter(
+                self.atomic_write, pipeline.get('queue_size', 4), self.logger, pipeline.get('writer_threads', 2))
+        elif output_writing.get('background_writer', False):
+            self.output_writer = BackgroundOutputWriter(
+                self.atomic_write, output_writing.get('max_pending_writes', 4), self.logger)
+
+        results = []
+        try:
+            if pipeline.get('enable', False):
+                self.logger.info(f"流水线模式: 读取线程{pipeline.get('reader_threads', 2)}, "
+                                 f"写入线程{pipeline.get('writer_threads', 2)}, 队列长度{pipeline.get('queue_size', 4)}")
+                results = self.run_pipeline(excel_files, output_dir)
+            else:
+                for file_path in excel_files:
+                    result = self.run_report(file_path, output_dir)
+                    results.append(result)
+
+                    if result['status'] != 'ok' and not self.config.ERROR_HANDLING['continue_on_error']:
+                        break
+        finally:
+            self.progress = None
+            if self.output_writer is not None:
+                write_failures = self.output_writer.close()
+                self.output_writer = None
+                for result in results:
+                    if result['output'] in write_failures and result['status'] == 'ok':
+                        result.update(status="error", message=f"写入输出文件失败: {write_failures[result['output']]}")
+
+        results = self.finish_batch(output_dir, results)
+        if archive is not None:
+            self.close_output_archive(archive, results, log_handler)
+        return results
+
+    def open_output_archive(self, output_dir):
+        """🆕 启用输出归档时创建归档写入器，并开始收集本次运行的日志，返回(归档, 日志处理器)"""
+        archive_config = self.config.OUTPUT_ARCHIVE
+        if not archive_config.get('enable', False):
+            return None, None
+
+        archive = OutputArchive(
+            output_dir,
+            datetime.now().strftime(archive_config.get('name_format', 'batch_%Y%m%d_%H%M%S')),
+            max_entries=archive_config.get('max_entries_per_archive', 0),
+            max_mb=archive_config.get('max_archive_mb', 0),
+            compress=archive_config.get('compress', False),
+            fsync=self.config.OUTPUT_WRITING.get('fsync', True),
+            logger=self.logger)
+
+        log_handler = None
+        if archive_config.get('include_log', True):
+            log_handler = logging.StreamHandler(io.StringIO())
+            log_handler.set_name(ARCHIVE_LOG_HANDLER)
+            log_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+            logging.getLogger().addHandler(log_handler)
+
+        self.logger.info(f"输出归档模式: {output_dir / archive.base_name}*.zip")
+        return archive, log_handler
+
+    def close_output_archive(self, archive, results, log_handler=None):
+        """把运行汇总和本次运行日志写入归档并完成归档"""
+        for result in results:
+            if result['status'] == 'ok':
+                result['archive'] = archive.entries.get(Path(result['output']).name)
+
+        summary = {
+            "generated_at": datetime.now().isoformat(timespec='seconds'),
+            "total_files": len(results),
+            "succeeded": sum(1 for r in results if r['status'] == 'ok'),
+            "failed": sum(1 for r in results if r['status'] != 'ok'),
+            "results": results
+        }
+        try:
+            archive.write("run_summary.json",
+                          json.dumps(summary, ensure_ascii=False, indent=2, default=str).encode('utf-8'))
+            if log_handler is not None:
+                logging.getLogger().removeHandler(log_handler)
+                archive.write("processor.log", log_handler.stream.getvalue().encode('utf-8'))
+            archive_paths = archive.close()
+            self.logger.info(f"输出已归档: {[str(path) for path in archive_paths]}")
+        except Exception as e:
+            self.logger.error(f"完成输出归档失败: {str(e)}")
+            self.logger.exception("详细错误信息:")
+
+    def schedule_files(self, excel_files, output_dir, track_progress=True):
+        """🆕 按调度策略排列待处理文件，并根据文件大小和历史耗时估算每个文件的处理成本
+
+        策略: largest_first（估算成本从大到小，缩短并行批次的尾部）、smallest_first、
+        newest_first / oldest_first（按修改时间）、name（按文件名）、none（保持目录顺序）。
+        """
+        scheduling = self.config.SCHEDULING
+        policy = scheduling.get('policy', 'largest_first')
+        estimates = self.estimate_file_costs(excel_files, self.load_timing_history())
+
+        sort_keys = {
+            "largest_first": (lambda f: estimates[str(f)], True),
+            "smallest_first": (lambda f: estimates[str(f)], False),
+            "newest_first": (lambda f: self.get_file_mtime(f), True),
+            "oldest_first": (lambda f: self.get_file_mtime(f), False),
+            "name": (lambda f: f.name, False)
+        }
+        if policy in sort_keys:
+            key, reverse = sort_keys[policy]
+            excel_files = sorted(excel_files, key=key, reverse=reverse)
+        elif policy != 'none':
+            self.logger.warning(f"未知的调度策略: {policy}，保持目录顺序")
+
+        total_cost = sum(estimates.values())
+        self.logger.info(f"调度策略: {policy}，预计总耗时约 {total_cost:.1f}s")
+        if track_progress and scheduling.get('progress', True):
+            self.progress = BatchProgress(estimates, self.logger, scheduling.get('progress_interval_seconds', 5))
+        return excel_files
+
+    def estimate_file_costs(self, excel_files, history):
+        """估算文件处理耗时(秒) - 同名同大小的文件直接使用历史耗时，其余按历史数据拟合的
+        "固定开销 + 每字节耗时"线性模型估算，历史不足时使用配置的默认值"""
+        scheduling = self.config.SCHEDULING
+        overhead = scheduling.get('default_overhead_seconds', 0.5)
+        per_byte = scheduling.get('default_seconds_per_mb', 2.0) / (1024 * 1024)
+
+        samples = [(entry['size'], entry['elapsed']) for entry in history.values() if entry.get('size')]
+        if len(samples) >= 2:
+            mean_size = sum(size for size, _ in samples) / len(samples)
+            mean_elapsed = sum(elapsed for _, elapsed in samples) / len(samples)
+            variance = sum((size - mean_size) ** 2 for size, _ in samples)
+            if variance > 0:
+                slope = sum((size - mean_size) * (elapsed - mean_elapsed) for size, elapsed in samples) / variance
+                if slope > 0:
+                    per_byte = slope
+                    overhead = max(0.0, mean_elapsed - slope * mean_size)
+            else:
+                overhead, per_byte = mean_elapsed, 0.0
+
+        estimates = {}
+        for file_path in excel_files:
+            try:
+                size = file_path.stat().st_size
+            except OSError:
+                size = 0
+            previous = history.get(file_path.name)
+            if previous and previous.get('size') == size:
+                estimates[str(file_path)] = previous['elapsed']
+            else:
+                estimates[str(file_path)] = overhead + size * per_byte
+        return estimates
+
+    @staticmethod
+    def get_file_mtime(file_path):
+        """文件修改时间，文件在列出后被删除或无法访问时返回0（排序时不中断批处理）"""
+        try:
+            return file_path.stat().st_mtime
+        except OSError:
+            return 0
+
+    def get_timing_history_path(self):
+        """历史耗时记录路径 - 放在缓存目录，不写入（纳入版本管理的）输出目录"""
+        return Path(self.config.SCHEDULING.get('history_file', '.cache/timing_history.json'))
+
+    def load_timing_history(self):
+        """读取历史耗时 {文件名: {"size", "elapsed", "finished_at"}}"""
+        history_path = self.get_timing_history_path()
+        if not history_path.exists():
+            return {}
+        try:
+            with open(history_path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            self.logger.warning(f"耗时历史无法读取，使用默认估算: {str(e)}")
+            return {}
+
+    def update_timing_history(self, results):
+        """把成功处理的文件耗时合并到历史记录，只保留最近history_size条"""
+        timed = [r for r in results if r['status'] == 'ok' and r.get('size_bytes')]
+        if not timed:
+            return
+
+        history = self.load_timing_history()
+        finished_at = datetime.now().isoformat(timespec='seconds')
+        for result in timed:
+            history.pop(result['file'], None)
+            history[result['file']] = {"size": result['size_bytes'], "elapsed": result['elapsed_seconds'],
+                                       "finished_at": finished_at}
+
+        history_size = self.config.SCHEDULING.get('history_size', 500)
+        history = dict(list(history.items())[-history_size:])
+        history_path = self.get_timing_history_path()
+        history_path.parent.mkdir(parents=True, exist_ok=True)
+        self.atomic_write(history_path,
+                          json.dumps(history, ensure_ascii=False, indent=2).encode('utf-8'))
+
+    def list_source_files(self, source_dir):
+        """列出源文件目录中的Excel文件"""
+        source_dir = Path(source_dir)
+        return list(source_dir.glob("*.xlsx")) + list(source_dir.glob("*.xls"))
+
+    def finish_batch(self, output_dir, results):
+        """批处理收尾：汇总日志、错误报告和批次异常统计"""
+        processed_count = sum(1 for r in results if r['status'] == 'ok')
+        error_count = len(results) - processed_count
+        self.logger.info(f"处理完成！成功: {processed_count}, 失败: {error_count}")
+
+        if error_count:
+            self.write_error_report(output_dir, results)
+
+        # 🆕 记录本批次的耗时，供下次调度估算文件处理成本
+        try:
+            self.update_timing_history(results)
+        except Exception as e:
+            self.logger.warning(f"更新耗时历史失败: {str(e)}")
+
+        # 🆕 批次详细异常统计汇总
+        detailed = self.config.ABNORMAL_STATISTICS['detailed_statistics']
+        all_statistics = [r['statistics'] for r in results if r.get('statistics')]
+        if detailed.get('enable', False) and detailed.get('batch_rollup', True) and all_statistics:
+            try:
+                self.write_statistics_rollup(output_dir, all_statistics)
+            except Exception as e:
+                self.logger.error(f"写入批次异常统计汇总失败: {str(e)}")
+                self.logger.exception("详细错误信息:")
+
+        # 🆕 合并各报告的SPC累加器，批次结束时写入一份汇总（无需再次读取输出）
+        all_spc = [r['spc'] for r in results if r.get('spc')]
+        if self.config.SPC_STATISTICS.get('enable', False) and all_spc:
+            try:
+                self.write_spc_summary(output_dir, all_spc)
+            except Exception as e:
+                self.logger.error(f"写入SPC统计汇总失败: {str(e)}")
+                self.logger.exception("详细错误信息:")
+
+        return results
+
+    def screen_report(self, file_path, source=None):
+        """🆕 筛查单个报告 - 只做读取、提取和限值判定，不加载模板、不生成工作簿
+
+        返回各数据组的异常样品数、异常单元格数和异常测试项，数据组划分与生成报告时一致。
+        """
+        self.logger.info(f"开始筛查: {file_path.name}")
+        df, test_data = self.load_source_report(file_path, source)
+        if df is None:
+            return None
+
+        test_info = self.extract_test_info(df)
+        template = self.match_template(file_path, test_info)
+        if template is None:
+            return None
+
+        rows = []
+        with self.use_template(template):
+            template_data = self.map_to_template_items(test_info)
+            for group in self.partition_test_data(test_data):
+                sample_ids, over, out_of_range = self.evaluate_abnormal_cells(group['rows'], template_data)
+                abnormal = over | out_of_range
+                abnormal_rows = abnormal.any(axis=1)
+                failing_items = abnormal.sum()
+                start_sample, end_sample = group['range']
+
+                rows.append({
+                    "file": file_path.name,
+                    "status": "ok",
+                    "template": template['name'],
+                    "group": group['name'],
+                    "samples_range": f"{start_sample}-{end_sample if end_sample != float('inf') else ''}",
+                    "samples": int(len(sample_ids)),
+                    "abnormal_count": int(abnormal_rows.sum()),
+                    "over_cells": int(over.values.sum()),
+                    "range_cells": int(out_of_range.values.sum()),
+                    "failing_items": "; ".join(f"{item}({int(count)})"
+                                               for item, count in failing_items.items() if count),
+                    "abnormal_samples": "; ".join(sample_ids[abnormal_rows])
+                })
+        return rows
+
+    def screen_all_reports(self):
+        """🆕 筛查模式 - 批量统计各文件/数据组的异常数量，输出一张紧凑的筛查表"""
+        source_dir = Path(self.config.SOURCE_DIR)
+        output_dir = Path(self.config.OUTPUT_DIR)
+        screening = self.config.SCREENING
+
+        excel_files = self.list_source_files(source_dir)
+        if not excel_files:
+            self.logger.warning(f"在 {source_dir} 中未找到Excel源文件")
+            return []
 
-        processed_count = 0
-        error_count = 0
+        self.logger.info(f"筛查模式：找到 {len(excel_files)} 个源文件")
+        self.build_template_registry(load_workbooks=False)
+        start_time = time.monotonic()
 
+        rows = []
         for file_path in excel_files:
             try:
-                self.logger.info(f"开始处理: {file_path.name}")
+                file_rows = self.screen_report(file_path)
+                message = "" if file_rows is not None else "筛查失败，详见日志"
+            except Exception as e:
+                self.logger.error(f"筛查文件 {file_path.name} 时发生错误: {str(e)}")
+                self.logger.exception("详细错误信息:")
+                file_rows, message = None, str(e)
+
+            if file_rows is None:
+                rows.append({"file": file_path.name, "status": "failed", "message": message})
+            else:
+                rows.extend(file_rows)
+
+        columns = ["file", "status", "template", "group", "samples_range", "samples", "abnormal_count",
+                   "over_cells", "range_cells", "failing_items", "abnormal_samples", "message"]
+        table = pd.DataFrame(rows, columns=columns)
+
+        buffer = io.BytesIO()
+        with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
+            table.to_excel(writer, sheet_name='筛查结果', index=False)
+        report_path = output_dir / screening.get('report_file', 'screening_report.xlsx')
+        self.atomic_write(report_path, buffer.getvalue())
+
+        if screening.get('log_table', True):
+            for row in rows:
+                if row['status'] != 'ok':
+                    self.logger.warning(f"[筛查] {row['file']}: 失败 {row['message']}")
+                elif row['abnormal_count']:
+                    self.logger.warning(f"[筛查] {row['file']} {row['group']}: 异常 {row['abnormal_count']} "
+                                        f"- {row['failing_items']}")
+
+        elapsed = time.monotonic() - start_time
+        abnormal_files = {row['file'] for row in rows if row.get('abnormal_count')}
+        self.logger.info(f"筛查完成！文件: {len(excel_files)}, 含异常: {len(abnormal_files)}, "
+                         f"耗时: {elapsed:.2f}s, 结果: {report_path}")
+        return rows
+
+    def compare_outputs(self, reference_dir, candidate_dir):
+        """🆕 逐单元格对比两个输出目录的报告（值、数值类型、填充），返回是否完全一致"""
+        golden = self.config.GOLDEN_CHECK
+        comparator = OutputComparator(
+            {self.config.HIGHLIGHT_COLOR: "超限高亮", self.config.OVER_VALUE_HIGHLIGHT_COLOR: "Over高亮"},
+            float_tolerance=golden.get('float_tolerance', 0.0),
+            file_pattern=golden.get('file_pattern', 'processed_*.xlsx'))
+        mismatches = comparator.compare_dirs(Path(reference_dir), Path(candidate_dir))
+
+        max_reported = golden.get('max_reported', 50)
+        for mismatch in mismatches[:max_reported]:
+            self.logger.error(f"[对比] {mismatch['file']} {mismatch['location']} {mismatch['kind']}: "
+                              f"期望 {mismatch['expected']!r}，实际 {mismatch['actual']!r}")
+        if len(mismatches) > max_reported:
+            self.logger.error(f"[对比] 另有 {len(mismatches) - max_reported} 处差异未列出")
+
+        kinds = {}
+        for mismatch in mismatches:
+            kinds[mismatch['kind']] = kinds.get(mismatch['kind'], 0) + 1
+        if mismatches:
+            self.logger.error(f"输出对比不一致: {reference_dir} vs {candidate_dir}，差异 {len(mismatches)} 处 {kinds}")
+        else:
+            self.logger.info(f"输出对比一致: {reference_dir} vs {candidate_dir} ({comparator.files_compared} 个文件)")
+        return not mismatches
+
+    def self_check(self):
+        """🆕 自检 - 用当前配置把样例源文件重新生成到临时目录，并与参考输出逐单元格对比
+
+        用于在启用新的读取/计算/写入路径（如xml_patch引擎、流水线）前确认输出与参考一致。
+        """
+        reference_dir = Path(self.config.GOLDEN_CHECK.get('reference_dir') or self.config.OUTPUT_DIR)
+        with tempfile.TemporaryDirectory(prefix="self_check_") as temp_dir:
+            # 报告需要以独立文件输出才能对比
+            self.config.OUTPUT_DIR = temp_dir
+            self.config.OUTPUT_ARCHIVE = dict(self.config.OUTPUT_ARCHIVE, enable=False)
+            self.logger.info(f"自检：重新生成报告到 {temp_dir}，参考目录 {reference_dir}")
+
+            results = self.process_all_reports() or []
+            if any(r['status'] != 'ok' for r in results):
+                self.logger.error("自检：部分报告生成失败")
+                self.compare_outputs(reference_dir, temp_dir)
+                return False
+            return self.compare_outputs(reference_dir, temp_dir)
+
+    def get_worker_id(self):
+        """分片实例标识 - 未配置时使用主机名和进程号"""
+        return self.config.SHARDING.get('worker_id') or f"{socket.gethostname()}-{os.getpid()}"
+
+    def get_shard_dirs(self):
+        """分片工作目录：claims(认领文件)、done(完成标记)、summaries(各分片运行汇总)"""
+        work_dir = Path(self.config.SHARDING['work_dir'])
+        dirs = {name: work_dir / name for name in ('claims', 'done', 'summaries')}
+        for path in dirs.values():
+            path.mkdir(parents=True, exist_ok=True)
+        dirs['work'] = work_dir
+        return dirs
+
+    def try_claim(self, claim_path, worker_id):
+        """原子创建认领文件（O_EXCL），认领已失去心跳时先回收再认领"""
+        for attempt in range(2):
+            try:
+                fd = os.open(claim_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                if attempt or not self.reclaim_stale_claim(claim_path, worker_id):
+                    return False
+                continue
+
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({"worker": worker_id, "claimed_at": datetime.now().isoformat(timespec='seconds')}, f)
+            return True
+        return False
+
+    def reclaim_stale_claim(self, claim_path, worker_id):
+        """回收心跳超时的认领文件 - 通过原子重命名保证只有一个实例回收成功"""
+        stale_after = self.config.SHARDING.get('stale_after_seconds', 120)
+        try:
+            if time.time() - claim_path.stat().st_mtime < stale_after:
+                return False
+        except FileNotFoundError:
+            return True
+
+        stale_path = claim_path.with_name(f"{claim_path.name}.stale-{worker_id}-{time.time_ns()}")
+        try:
+            os.rename(claim_path, stale_path)
+        except FileNotFoundError:
+            return True
+
+        # 检查期间认领可能已被其它实例回收并重新创建，误移的有效认领需要还原
+        if time.time() - stale_path.stat().st_mtime < stale_after:
+            try:
+                os.link(stale_path, claim_path)
+            except OSError:
+                pass
+            stale_path.unlink()
+            return False
+
+        with open(stale_path, encoding='utf-8', errors='replace') as f:
+            previous = f.read().strip()
+        stale_path.unlink()
+        self.logger.warning(f"回收失去心跳的认领: {claim_path.name} (原认领: {previous})")
+        return True
+
+    def release_claim(self, claim_path, worker_id):
+        """释放本实例的认领 - 先原子重命名再检查归属，认领已被其它实例回收时原样还原"""
+        released_path = claim_path.with_name(f"{claim_path.name}.release-{worker_id}-{time.time_ns()}")
+        try:
+            os.rename(claim_path, released_path)
+        except FileNotFoundError:
+            return
+
+        owner = ClaimHeartbeat.read_owner(released_path)
+        if owner != worker_id:
+            self.logger.warning(f"认领 {claim_path.name} 已被 {owner} 回收，保留其认领")
+            try:
+                os.link(released_path, claim_path)
+            except OSError:
+                pass
+        released_path.unlink()
+
+    def process_shard(self):
+        """🆕 分片模式 - 多个实例（本机或共享文件系统上的多台主机）共同处理同一批源文件
+
+        每个源文件通过在共享工作目录中原子创建认领文件分配给一个实例，处理期间定期更新认领文件的
+        修改时间作为心跳；实例异常退出后，认领在stale_after_seconds后可被其它实例回收。
+        处理完成（含失败）的文件写入完成标记（按文件名、大小和修改时间），本实例结束时写入自己的运行汇总，
+        由merge_shard_summaries合并。
+        """
+        sharding = self.config.SHARDING
+        source_dir = Path(self.config.SOURCE_DIR)
+        output_dir = Path(self.config.OUTPUT_DIR)
+        dirs = self.get_shard_dirs()
+        worker_id = self.get_worker_id()
+        started_at = datetime.now().isoformat(timespec='seconds')
+
+        self.logger.info(f"分片实例 {worker_id} 启动，工作目录: {dirs['work']}")
+        if not self.build_template_registry():
+            self.logger.error(f"没有可用的模板文件: {self.config.TEMPLATE_DIR}")
+            return []
+
+        excel_files = self.schedule_files(self.group_retest_files(self.list_source_files(source_dir)),
+                                          output_dir, track_progress=False)
+        results = []
 
-                df = self.read_source_data(file_path)
-                if df is None:
-                    error_count += 1
+        while True:
+            remaining = [f for f in excel_files if not self.get_done_marker_path(dirs, f).exists()]
+            if not remaining:
+                break
+
+            claimed_any = False
+            for file_path in remaining:
+                done_path = self.get_done_marker_path(dirs, file_path)
+                claim_path = dirs['claims'] / f"{file_path.name}.claim"
+                if done_path.exists() or not self.try_claim(claim_path, worker_id):
                     continue
 
-                test_info = self.extract_test_info(df)
-                test_data = self.extract_test_data(df)
-                template_data = self.map_to_template_items(test_info)
+                claimed_any = True
+                heartbeat = ClaimHeartbeat(claim_path, worker_id, sharding.get('heartbeat_seconds', 30), self.logger)
+                try:
+                    # 认领前可能刚被其它实例完成
+                    if done_path.exists():
+                        continue
+
+                    result = self.run_report(file_path, output_dir)
+                    result['worker'] = worker_id
+                    result['finished_at'] = datetime.now().isoformat(timespec='seconds')
+                    results.append(result)
+                    self.atomic_write(done_path, json.dumps(result, ensure_ascii=False).encode('utf-8'))
+                finally:
+                    heartbeat.stop()
+                    self.release_claim(claim_path, worker_id)
+
+            # 剩余文件都被其它存活实例认领时，等待其完成或认领过期
+            if not claimed_any:
+                time.sleep(sharding.get('poll_seconds', 5))
+
+        summary = {
+            "worker": worker_id,
+            "host": socket.gethostname(),
+            "pid": os.getpid(),
+            "started_at": started_at,
+            "finished_at": datetime.now().isoformat(timespec='seconds'),
+            "results": results
+        }
+        summary_path = dirs['summaries'] / f"{worker_id}.json"
+        self.atomic_write(summary_path, json.dumps(summary, ensure_ascii=False, indent=2).encode('utf-8'))
+        self.logger.info(f"分片实例 {worker_id} 完成，处理 {len(results)} 个文件，汇总: {summary_path}")
+        return results
+
+    @staticmethod
+    def get_done_marker_path(dirs, file_path):
+        """完成标记路径 - 按文件名、大小和修改时间区分，源文件被替换或修改后会重新处理"""
+        try:
+            stat = file_path.stat()
+            version = f"{stat.st_size}-{stat.st_mtime_ns}"
+        except OSError:
+            version = "missing"
+        return dirs['done'] / f"{file_path.name}.{version}.json"
+
+    def merge_shard_summaries(self):
+        """🆕 合并各分片的运行汇总 - 同一文件有多条结果时取最后完成的一条"""
+        dirs = self.get_shard_dirs()
+        output_dir = Path(self.config.OUTPUT_DIR)
+
+        merged = {}
+        workers = {}
+        for summary_path in sorted(dirs['summaries'].glob("*.json")):
+            with open(summary_path, encoding='utf-8') as f:
+                summary = json.load(f)
+            workers[summary['worker']] = len(summary['results'])
+            for result in summary['results']:
+                previous = merged.get(result['path'])
+                if previous is None or result.get('finished_at', '') >= previous.get('finished_at', ''):
+                    merged[result['path']] = result
+
+        results = sorted(merged.values(), key=lambda r: r['file'])
+        run_summary = {
+            "merged_at": datetime.now().isoformat(timespec='seconds'),
+            "workers": workers,
+            "total_files": len(results),
+            "succeeded": sum(1 for r in results if r['status'] == 'ok'),
+            "failed": sum(1 for r in results if r['status'] != 'ok'),
+            "results": results
+        }
+        summary_path = dirs['work'] / 'run_summary.json'
+        self.atomic_write(summary_path, json.dumps(run_summary, ensure_ascii=False, indent=2).encode('utf-8'))
+        self.logger.info(f"已合并 {len(workers)} 个分片的运行汇总: {summary_path}")
+
+        return self.finish_batch(output_dir, results)
+
+    def run_local_shards(self, shard_count):
+        """在本机启动多个独立的分片进程，全部结束后合并汇总（无需外部调度）"""
+        context = multiprocessing.get_context()
+        base_id = f"{socket.gethostname()}-{os.getpid()}"
+        processes = [context.Process(target=_shard_worker, args=(f"{base_id}-shard{i + 1}",))
+                     for i in range(shard_count)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+            if process.exitcode:
+                self.logger.error(f"分片进程 {process.name} 异常退出，退出码 {process.exitcode}")
+
+        return self.merge_shard_summaries()
+
+    def run_service(self):
+        """🆕 启动常驻转换服务（见ConversionService）"""
+        ConversionService(self).serve()
+
+
+class ClaimHeartbeat:
+    """🆕 认领心跳线程 - 定期更新认领文件的修改时间，表明认领实例仍在处理
+
+    认领已被其它实例回收（文件中的实例标识不再是本实例）时停止续期，避免替对方的认领续命后又误删。
+    """
+
+    def __init__(self, claim_path, worker_id, interval, logger=None):
+        self.claim_path = claim_path
+        self.worker_id = worker_id
+        self.interval = interval
+        self.logger = logger or logging.getLogger(__name__)
+        self.lost = False
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="claim-heartbeat", daemon=True)
+        self.thread.start()
+
+    @staticmethod
+    def read_owner(claim_path):
+        """读取认领文件中的实例标识，文件不存在或无法解析时返回None"""
+        try:
+            with open(claim_path, encoding='utf-8') as f:
+                return json.load(f).get('worker')
+        except (OSError, ValueError, AttributeError):
+            return None
 
-                output_file = output_dir / f"processed_{file_path.stem}.xlsx"
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            if self.read_owner(self.claim_path) != self.worker_id:
+                self.lost = True
+                self.logger.warning(f"认领已被移除或被其它实例回收，停止心跳: {self.claim_path.name}")
+                return
+            try:
+                os.utime(self.claim_path)
+            except FileNotFoundError:
+                self.lost = True
+                self.logger.warning(f"认领文件已被移除: {self.claim_path.name}")
+                return
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+
+class OutputComparator:
+    """🆕 输出对比 - 逐单元格比较两个目录中同名报告的值、数值类型和填充颜色
+
+    整数与浮点数视为不同类型（例如写入3与3.0）；填充按高亮含义描述（超限高亮/Over高亮），
+    便于区分高亮类型错误和颜色缺失。float_tolerance为0时数值必须完全相等。
+    """
+
+    def __init__(self, highlight_labels, float_tolerance=0.0, file_pattern="processed_*.xlsx"):
+        self.highlight_labels = {color.upper()[-6:]: label for color, label in highlight_labels.items()}
+        self.float_tolerance = float_tolerance
+        self.file_pattern = file_pattern
+        self.files_compared = 0
+
+    def compare_dirs(self, reference_dir, candidate_dir):
+        """对比两个目录，返回差异列表 [{file, location, kind, expected, actual}]"""
+        mismatches = []
+        reference_files = {path.name: path for path in reference_dir.glob(self.file_pattern)}
+        candidate_files = {path.name: path for path in candidate_dir.glob(self.file_pattern)}
+
+        for name in sorted(reference_files.keys() - candidate_files.keys()):
+            mismatches.append(self.mismatch(name, "-", "文件缺失", name, None))
+        for name in sorted(candidate_files.keys() - reference_files.keys()):
+            mismatches.append(self.mismatch(name, "-", "多余文件", None, name))
+
+        for name in sorted(reference_files.keys() & candidate_files.keys()):
+            mismatches.extend(self.compare_workbooks(name, reference_files[name], candidate_files[name]))
+            self.files_compared += 1
+        return mismatches
+
+    def compare_workbooks(self, name, reference_path, candidate_path):
+        mismatches = []
+        reference = openpyxl.load_workbook(reference_path)
+        candidate = openpyxl.load_workbook(candidate_path)
+
+        if reference.sheetnames != candidate.sheetnames:
+            mismatches.append(self.mismatch(name, "-", "工作表", reference.sheetnames, candidate.sheetnames))
+
+        for reference_sheet in reference.worksheets:
+            if reference_sheet.title not in candidate.sheetnames:
+                continue
+            candidate_sheet = candidate[reference_sheet.title]
+
+            reference_merged = sorted(str(r) for r in reference_sheet.merged_cells.ranges)
+            candidate_merged = sorted(str(r) for r in candidate_sheet.merged_cells.ranges)
+            if reference_merged != candidate_merged:
+                mismatches.append(self.mismatch(name, reference_sheet.title, "合并单元格",
+                                                reference_merged, candidate_merged))
+
+            max_row = max(reference_sheet.max_row, candidate_sheet.max_row)
+            max_col = max(reference_sheet.max_column, candidate_sheet.max_column)
+            rows = zip(reference_sheet.iter_rows(max_row=max_row, max_col=max_col),
+                       candidate_sheet.iter_rows(max_row=max_row, max_col=max_col))
+            for reference_row, candidate_row in rows:
+                for expected, actual in zip(reference_row, candidate_row):
+                    location = f"{reference_sheet.title}!{expected.coordinate}"
+                    if not self.values_equal(expected.value, actual.value):
+                        mismatches.append(self.mismatch(name, location, "值", expected.value, actual.value))
+                    elif self.value_type(expected.value) != self.value_type(actual.value):
+                        mismatches.append(self.mismatch(name, location, "类型",
+                                                        self.value_type(expected.value),
+                                                        self.value_type(actual.value)))
+
+                    expected_fill, actual_fill = self.describe_fill(expected), self.describe_fill(actual)
+                    if expected_fill != actual_fill:
+                        mismatches.append(self.mismatch(name, location, "填充", expected_fill, actual_fill))
+
+        reference.close()
+        candidate.close()
+        return mismatches
+
+    def values_equal(self, expected, actual):
+        numeric = (int, float)
+        if (self.float_tolerance and isinstance(expected, numeric) and isinstance(actual, numeric)
+                and not isinstance(expected, bool) and not isinstance(actual, bool)):
+            return math.isclose(expected, actual, rel_tol=0.0, abs_tol=self.float_tolerance)
+        return expected == actual
+
+    @staticmethod
+    def value_type(value):
+        return type(value).__name__
+
+    def describe_fill(self, cell):
+        """把单元格填充描述为可比较的文本，高亮颜色按含义标注"""
+        fill = cell.fill
+        if fill is None or fill.fill_type is None:
+            return "无填充"
+
+        color = fill.fgColor
+        if color.type == 'rgb':
+            rgb = str(color.rgb).upper()[-6:]
+            label = self.highlight_labels.get(rgb)
+            return f"{label}({rgb})" if label else f"{fill.fill_type}:{rgb}"
+        if color.type == 'theme':
+            return f"{fill.fill_type}:theme{color.theme}/tint{round(color.tint, 4)}"
+        return f"{fill.fill_type}:{color.type}{color.value}"
+
+    @staticmethod
+    def mismatch(file_name, location, kind, expected, actual):
+        return {"file": file_name, "location": location, "kind": kind, "expected": expected, "actual": actual}
+
+
+class OutputArchive:
+    """🆕 批次输出归档 - 把工作簿、运行汇总和日志顺序写入少量zip归档
+
+    网络共享上逐个创建小文件时元数据往返占主要耗时，归档只创建少数几个大文件并顺序写入。
+    每个归档包含manifest.json（条目列表），写入期间使用.partial临时名，完成后原子重命名。
+    超过max_entries条目或max_mb大小时滚动到下一个归档（0表示不限制）。
+    """
+
+    MANIFEST_NAME = "manifest.json"
+
+    def __init__(self, output_dir, base_name, max_entries=0, max_mb=0, compress=False, fsync=True, logger=None):
+        self.output_dir = Path(output_dir)
+        self.base_name = base_name
+        self.max_entries = max_entries
+        self.max_bytes = max_mb * 1024 * 1024
+        self.compression = ZIP_DEFLATED if compress else ZIP_STORED  # xlsx本身已压缩，默认只存储
+        self.fsync = fsync
+        self.logger = logger or logging.getLogger(__name__)
+        self.lock = threading.Lock()
+        self.archives = []  # 已完成的归档路径
+        self.entries = {}  # 条目名 -> 所在归档文件名
+        self.current = None
+
+    def write_output(self, output_path, data):
+        """后台写入线程的写入函数 - 以输出文件名作为条目名"""
+        self.write(Path(output_path).name, data)
+
+    def write(self, name, data):
+        with self.lock:
+            if self.current is not None and self._is_full(len(data)):
+                self._finish_current()
+            if self.current is None:
+                self._open_next()
+
+            self.current['zip'].writestr(name, data, compress_type=self.compression)
+            self.current['entries'].append({"name": name, "size": len(data)})
+            self.current['bytes'] += len(data)
+            self.entries[name] = self.current['path'].name
+
+    def close(self):
+        """完成当前归档，返回所有归档路径"""
+        with self.lock:
+            if self.current is not None:
+                self._finish_current()
+        return self.archives
+
+    def _is_full(self, incoming_bytes):
+        if self.max_entries and len(self.current['entries']) >= self.max_entries:
+            return True
+        return bool(self.max_bytes and self.current['entries']
+                    and self.current['bytes'] + incoming_bytes > self.max_bytes)
+
+    def _open_next(self):
+        index = len(self.archives) + 1
+        suffix = "" if not (self.max_entries or self.max_bytes) else f"_{index:03d}"
+        path = self.output_dir / f"{self.base_name}{suffix}.zip"
+        partial_path = path.with_name(path.name + ".partial")
+        handle = open(partial_path, 'wb')
+        self.current = {
+            "path": path,
+            "partial": partial_path,
+            "handle": handle,
+            "zip": ZipFile(handle, 'w', self.compression, allowZip64=True),
+            "entries": [],
+            "bytes": 0
+        }
+
+    def _finish_current(self):
+        current, self.current = self.current, None
+        manifest = {"archive": current['path'].name, "index": len(self.archives) + 1,
+                    "created_at": datetime.now().isoformat(timespec='seconds'), "entries": current['entries']}
+        current['zip'].writestr(self.MANIFEST_NAME, json.dumps(manifest, ensure_ascii=False, indent=2))
+        current['zip'].close()
+        current['handle'].flush()
+        if self.fsync:
+            os.fsync(current['handle'].fileno())
+        current['handle'].close()
+        os.replace(current['partial'], current['path'])
+        self.archives.append(current['path'])
+        self.logger.info(f"归档完成: {current['path']} ({len(current['entries'])} 个条目)")
+
+    @classmethod
+    def list_entries(cls, archive_path):
+        """列出归档中的条目 [(条目名, 大小)]，不含manifest"""
+        with ZipFile(archive_path) as archive:
+            return [(info.filename, info.file_size) for info in archive.infolist()
+                    if info.filename != cls.MANIFEST_NAME]
+
+    @classmethod
+    def extract(cls, archive_path, target_dir, names=None):
+        """从归档中提取条目（默认全部）到目标目录，返回提取的文件路径"""
+        target_dir = Path(target_dir)
+        target_dir.mkdir(parents=True, exist_ok=True)
+        extracted = []
+        with ZipFile(archive_path) as archive:
+            available = [name for name in archive.namelist() if name != cls.MANIFEST_NAME]
+            for name in names or available:
+                if name not in available:
+                    raise KeyError(f"归档中不存在条目: {name}")
+                target = target_dir / Path(name).name
+                with archive.open(name) as source, open(target, 'wb') as f:
+                    f.write(source.read())
+                extracted.append(target)
+        return extracted
+
+
+class BatchProgress:
+    """🆕 批处理进度 - 按估算成本计算完成比例，并用实际速度校准剩余时间"""
+
+    def __init__(self, estimates, logger, interval=5):
+        self.estimates = estimates
+        self.logger = logger
+        self.interval = interval
+        self.total = len(estimates)
+        self.total_cost = sum(estimates.values()) or 1.0
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.last_report = self.started
+        self.done = 0
+        self.done_cost = 0.0
+        self.done_bytes = 0
+
+    def update(self, result):
+        with self.lock:
+            self.done += 1
+            self.done_cost += self.estimates.get(result['path'], 0.0)
+            self.done_bytes += result.get('size_bytes', 0)
+            now = time.monotonic()
+            if self.done < self.total and now - self.last_report < self.interval:
+                return
+            self.last_report = now
+            self.report(now)
+
+    def report(self, now):
+        elapsed = max(now - self.started, 1e-6)
+        fraction = min(1.0, self.done_cost / self.total_cost)
+        # 已完成部分的实际耗时/估算耗时作为校准系数
+        eta = (self.total_cost - self.done_cost) * elapsed / self.done_cost if self.done_cost else None
+        self.logger.info(
+            f"进度: {self.done}/{self.total} 文件 ({fraction:.0%}) | "
+            f"{self.done / elapsed:.2f} 文件/秒, {self.done_bytes / elapsed / 1024 / 1024:.2f} MB/秒 | "
+            f"已用 {elapsed:.1f}s, 预计剩余 {'未知' if eta is None else f'{max(eta, 0.0):.1f}s'}")
+
+
+class SpcAccumulator:
+    """🆕 单个测试项的SPC在线累加器 - Welford算法，可与其它工作进程的累加器合并"""
+
+    def __init__(self, test_item, condition='', lsl=None, usl=None):
+        self.test_item = test_item
+        self.condition = condition
+        self.lsl = lsl
+        self.usl = usl
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0  # 与均值之差的平方和
+        self.minimum = None
+        self.maximum = None
+        self.over = 0
+        self.out_of_limit = 0
+
+    def add_values(self, values):
+        for value in values:
+            self.count += 1
+            delta = value - self.mean
+            self.mean += delta / self.count
+            self.m2 += delta * (value - self.mean)
+            self.minimum = value if self.minimum is None else min(self.minimum, value)
+            self.maximum = value if self.maximum is None else max(self.maximum, value)
+
+    def merge(self, other):
+        """合并另一个累加器（Chan等人的并行方差合并公式）"""
+        if other.count:
+            total = self.count + other.count
+            delta = other.mean - self.mean
+            self.m2 += other.m2 + delta * delta * self.count * other.count / total
+            self.mean += delta * other.count / total
+            self.count = total
+            self.minimum = other.minimum if self.minimum is None else min(self.minimum, other.minimum)
+            self.maximum = other.maximum if self.maximum is None else max(self.maximum, other.maximum)
+        self.over += other.over
+        self.out_of_limit += other.out_of_limit
+
+    def std(self):
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else None
+
+    def cpk(self):
+        """过程能力指数，只有单侧限值时取单侧；标准差为0或样本不足时为None"""
+        sigma = self.std()
+        if not sigma:
+            return None
+        sides = []
+        if self.usl is not None:
+            sides.append((self.usl - self.mean) / (3 * sigma))
+        if self.lsl is not None:
+            sides.append((self.mean - self.lsl) / (3 * sigma))
+        return min(sides) if sides else None
+
+    def summary(self):
+        std, cpk = self.std(), self.cpk()
+        return {
+            "test_item": self.test_item,
+            "condition": self.condition,
+            "lsl": self.lsl,
+            "usl": self.usl,
+            "count": self.count,
+            "mean": self.mean if self.count else None,
+            "std": std,
+            "min": self.minimum,
+            "max": self.maximum,
+            "over": self.over,
+            "out_of_limit": self.out_of_limit,
+            "cpk": round(cpk, 4) if cpk is not None else None
+        }
+
+    def to_dict(self):
+        return dict(self.__dict__)
+
+    @classmethod
+    def from_dict(cls, state):
+        accumulator = cls(state['test_item'])
+        accumulator.__dict__.update(state)
+        return accumulator
+
+
+class ServiceMetrics:
+    """🆕 转换服务的请求统计 - 线程安全"""
+
+    def __init__(self, window=1000):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.counts = {"requests": 0, "ok": 0, "failed": 0, "rejected": 0, "timeout": 0}
+        self.in_flight = 0
+        self.latencies = deque(maxlen=window)  # 最近请求的耗时，用于计算分位数
+
+    def begin(self):
+        with self.lock:
+            self.counts['requests'] += 1
+            self.in_flight += 1
+
+    def end(self, status, elapsed=None):
+        with self.lock:
+            self.in_flight -= 1
+            self.counts[status] += 1
+            if elapsed is not None:
+                self.latencies.append(elapsed)
+
+    def snapshot(self):
+        with self.lock:
+            latencies = sorted(self.latencies)
+            snapshot = dict(self.counts, in_flight=self.in_flight,
+                            uptime_seconds=round(time.time() - self.started, 1))
+
+        if latencies:
+            snapshot['latency_seconds'] = {
+                "avg": round(sum(latencies) / len(latencies), 3),
+                "p50": round(latencies[len(latencies) // 2], 3),
+                "p95": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 3),
+                "max": round(latencies[-1], 3)
+            }
+        return snapshot
+
+
+class ConversionService:
+    """🆕 常驻转换服务 - 本地HTTP或Unix套接字接口
+
+    工作进程池中的每个进程在启动时创建一次SmartReportProcessor并加载模板注册表，
+    之后的请求复用已加载的模板、写入计划和解析缓存，避免每次转换重新启动解释器。
+
+    接口:
+      POST /convert?filename=<源文件名>   请求体为源工作簿内容；默认返回xlsx，
+                                          状态和异常计数放在X-Report-Summary响应头（JSON）；
+                                          format=json时返回JSON（工作簿为base64，含完整统计）
+      GET  /metrics                       请求统计（数量、并发、耗时分位数）
+      GET  /health                        服务状态
+    """
+
+    def __init__(self, processor):
+        self.processor = processor
+        self.logger = processor.logger
+        self.settings = processor.config.SERVICE
+        self.workers = max(1, self.settings.get('workers', 2))
+        self.slots = threading.BoundedSemaphore(self.settings.get('max_concurrent') or self.workers)
+        self.metrics = ServiceMetrics()
+        self.pool = None
+        self.pool_lock = threading.Lock()
+        self.pool_users = {}  # 进程池 -> 正在使用该进程池的请求数（超时后被替换的旧进程池等待其归零后终止）
+
+    def serve(self):
+        # 启动前先校验模板，模板不可用时不启动服务
+        if not self.processor.build_template_registry():
+            self.logger.error(f"没有可用的模板文件: {self.processor.config.TEMPLATE_DIR}")
+            return
 
-                self.write_to_template(template_path, output_file, template_data, test_data)
-                processed_count += 1
+        self.pool = self.create_pool()
+        server = self.create_server()
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            self.logger.info("转换服务停止")
+        finally:
+            server.server_close()
+            with self.pool_lock:
+                pools = set(self.pool_users) | {self.pool}
+            for pool in pools:
+                pool.terminate()
+                pool.join()
+
+    def create_pool(self):
+        return multiprocessing.get_context().Pool(self.workers, initializer=_service_worker_init)
+
+    def acquire_pool(self):
+        with self.pool_lock:
+            pool = self.pool
+            self.pool_users[pool] = self.pool_users.get(pool, 0) + 1
+        return pool
+
+    def release_pool(self, pool):
+        """请求结束时释放进程池；已被替换的旧进程池在最后一个请求结束后终止"""
+        with self.pool_lock:
+            self.pool_users[pool] -= 1
+            retired = pool is not self.pool and self.pool_users[pool] == 0
+            if retired:
+                del self.pool_users[pool]
+        if retired:
+            pool.terminate()
+            pool.join()
+
+    def recycle_pool(self, pool):
+        """超时后替换工作进程池 - 卡住的工作进程无法单独结束，继续保留会永久占用一个工作进程"""
+        with self.pool_lock:
+            if self.pool is not pool:
+                return  # 已被其它超时请求替换
+            self.pool = self.create_pool()
+        self.logger.warning("转换超时，已替换工作进程池（旧进程池在其余请求完成后终止）")
+
+    def create_server(self):
+        handler = type('ConversionRequestHandler', (ConversionRequestHandler,), {"service": self})
+        unix_socket = self.settings.get('unix_socket')
+        if unix_socket:
+            if os.path.exists(unix_socket):
+                os.unlink(unix_socket)
+            server = ThreadingUnixHTTPServer(unix_socket, handler)
+            self.logger.info(f"转换服务已启动: unix:{unix_socket}，工作进程: {self.workers}")
+        else:
+            server = ThreadingHTTPServer((self.settings.get('host', '127.0.0.1'), self.settings.get('port', 8765)),
+                                         handler)
+            self.logger.info(f"转换服务已启动: http://{server.server_address[0]}:{server.server_address[1]}，"
+                             f"工作进程: {self.workers}")
+        return server
+
+    def convert(self, filename, data):
+        """在工作进程池中转换一个源工作簿，返回(HTTP状态码, 结果)"""
+        self.metrics.begin()
+        status, elapsed = 'failed', None
+        try:
+            if not self.slots.acquire(timeout=self.settings.get('queue_timeout_seconds', 30)):
+                status = 'rejected'
+                return 503, {"status": "rejected", "message": "服务繁忙，请稍后重试"}
 
+            start_time = time.monotonic()
+            pool = self.acquire_pool()
+            try:
+                pending = pool.apply_async(_service_convert, (filename, data))
+                result = pending.get(timeout=self.processor.config.ERROR_HANDLING.get('file_timeout_seconds') or None)
+            except multiprocessing.TimeoutError:
+                self.recycle_pool(pool)
+                status, elapsed = 'timeout', time.monotonic() - start_time
+                return 504, {"status": "timeout", "message": "转换超时"}
             except Exception as e:
-                error_count += 1
-                self.logger.error(f"处理文件 {file_path.name} 时发生错误: {str(e)}")
+                self.logger.error(f"转换请求失败 {filename}: {str(e)}")
                 self.logger.exception("详细错误信息:")
+                elapsed = time.monotonic() - start_time
+                return 500, {"status": "error", "message": str(e)}
+            finally:
+                self.release_pool(pool)
+                self.slots.release()
+
+            elapsed = time.monotonic() - start_time
+            result['elapsed_seconds'] = round(elapsed, 3)
+            if result['status'] == 'ok':
+                status = 'ok'
+                return 200, result
+            return 422, result
+        finally:
+            self.metrics.end(status, elapsed)
+
+
+class ConversionRequestHandler(BaseHTTPRequestHandler):
+    """转换服务的HTTP请求处理"""
+
+    service = None
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        if path == '/metrics':
+            self.send_json(200, self.service.metrics.snapshot())
+        elif path == '/health':
+            templates = self.service.processor.template_registry or []
+            self.send_json(200, {"status": "ok", "workers": self.service.workers,
+                                 "templates": [t['name'] for t in templates]})
+        else:
+            self.send_json(404, {"status": "error", "message": f"未知路径: {path}"})
 
-                if not self.config.ERROR_HANDLING['continue_on_error']:
-                    break
+    def do_POST(self):
+        url = urlsplit(self.path)
+        if url.path != '/convert':
+            self.send_json(404, {"status": "error", "message": f"未知路径: {url.path}"})
+            return
 
-        self.logger.info(f"处理完成！成功: {processed_count}, 失败: {error_count}")
+        params = parse_qs(url.query)
+        filename = Path(params.get('filename', ['upload.xlsx'])[0]).name
+        length = int(self.headers.get('Content-Length') or 0)
+        max_upload = self.service.settings.get('max_upload_mb', 50) * 1024 * 1024
+        if length <= 0 or length > max_upload:
+            self.send_json(413 if length else 400, {"status": "error", "message": "请求体为空或超过上传大小限制"})
+            return
+
+        status_code, result = self.service.convert(filename, self.rfile.read(length))
+        workbook = result.pop('workbook', None)
+        if params.get('format', [''])[0] == 'json' or workbook is None:
+            if workbook is not None:
+                result['workbook'] = base64.b64encode(workbook).decode('ascii')
+            self.send_json(status_code, result)
+            return
+
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+        self.send_header('Content-Disposition', f'attachment; filename="processed_{Path(filename).stem}.xlsx"')
+        self.send_header('X-Report-Summary', json.dumps(self.summary_header(result)))
+        self.send_header('Content-Length', str(len(workbook)))
+        self.end_headers()
+        self.wfile.write(workbook)
+
+    @staticmethod
+    def summary_header(result):
+        """响应头中的精简摘要 - 只含状态和计数，完整统计通过format=json获取（避免超出请求头大小限制）"""
+        groups = result.get('groups') or []
+        return {
+            "status": result.get('status'),
+            "file": result.get('file'),
+            "groups": len(groups),
+            "samples": sum(g['samples'] for g in groups),
+            "abnormal_count": result.get('abnormal_count', 0),
+            "group_abnormal_counts": [g['abnormal_count'] for g in groups],
+            "elapsed_seconds": result.get('elapsed_seconds')
+        }
+
+    def send_json(self, status_code, payload):
+        body = json.dumps(payload, ensure_ascii=False, default=str).encode('utf-8')
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        self.service.logger.debug(f"转换服务请求: {format % args}")
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """基于Unix套接字的多线程HTTP服务"""
+
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = super().get_request()
+        return request, ('unix', 0)
+
+
+class XmlPatchTemplate:
+    """🆕 直接修补工作表XML的输出引擎 - 模板zip只解析一次
+
+    未改动的部件（样式、绘图、图片、其它工作表等）预先打包成基础zip，保存时原样复制其压缩数据；
+    每份报告只重新生成目标工作表的XML（未写入的行保持模板原始XML），保存开销与写入的数据量相关。
+    """
+
+    SHEET_DATA_RE = re.compile(r'<sheetData\s*/>|<sheetData>(.*?)</sheetData>', re.S)
+    ROW_RE = re.compile(r'<row\b([^>]*?)(?:/>|>(.*?)</row>)', re.S)
+    CELL_RE = re.compile(r'<c\b([^>]*?)(?:/>|>(.*?)</c>)', re.S)
+    REF_RE = re.compile(r'\br="([A-Z]+)(\d+)"')
+    ROW_NUMBER_RE = re.compile(r'\br="(\d+)"')
+    STYLE_RE = re.compile(r'\bs="(\d+)"')
+    SPANS_RE = re.compile(r'\sspans="[^"]*"')
+    DIMENSION_RE = re.compile(r'<dimension ref="([A-Z]+)(\d+)(?::([A-Z]+)(\d+))?"\s*/>')
+    XF_RE = re.compile(r'<xf\b[^>]*?(?:/>|>.*?</xf>)', re.S)
+
+    def __init__(self, template_path, target_sheet_indices, highlight_fills=(), compression_level=None):
+        with ZipFile(template_path) as archive:
+            self.parts = {info.filename: archive.read(info.filename) for info in archive.infolist()}
+
+        self.compression_level = compression_level
+        self.sheet_titles, self.sheet_parts = self._read_sheet_parts()
+        self.sheets = {index: self._compile_sheet(self.parts[self.sheet_parts[index]].decode('utf-8'))
+                       for index in target_sheet_indices if index < len(self.sheet_parts)}
+        self._drop_calc_chain()
+
+        self.styles_xml = self.parts['xl/styles.xml'].decode('utf-8')
+        self.base_xf_count = len(self._cell_xfs()[1])
+        self.fill_variants = {}
+        for fill in highlight_fills:
+            self._add_fill_variant(fill_key(fill), build_base=False)
+        self._build_base()
+
+    def _read_sheet_parts(self):
+        """按工作簿顺序读取工作表名称及其XML部件路径"""
+        main_ns = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+        rel_ns = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+        workbook = ElementTree.fromstring(self.parts['xl/workbook.xml'])
+        rels = ElementTree.fromstring(self.parts['xl/_rels/workbook.xml.rels'])
+        targets = {rel.get('Id'): rel.get('Target') for rel in rels}
+
+        titles, sheet_parts = [], []
+        for sheet in workbook.iter(f'{main_ns}sheet'):
+            target = targets[sheet.get(f'{rel_ns}id')]
+            titles.append(sheet.get('name'))
+            sheet_parts.append(target.lstrip('/') if target.startswith('/') else f'xl/{target}')
+        return titles, sheet_parts
+
+    def _compile_sheet(self, sheet_xml):
+        """将工作表XML拆分为前缀、按行号索引的行和后缀"""
+        match = self.SHEET_DATA_RE.search(sheet_xml)
+        if match is None:
+            raise ValueError("工作表XML中没有sheetData")
+
+        rows = {}
+        for row_match in self.ROW_RE.finditer(match.group(1) or ''):
+            row_attrs, row_body = row_match.group(1), row_match.group(2) or ''
+            row_number = self.ROW_NUMBER_RE.search(row_attrs)
+            if row_number is None:
+                raise ValueError("工作表行缺少行号属性")
+
+            cells = {}
+            for cell_match in self.CELL_RE.finditer(row_body):
+                ref = self.REF_RE.search(cell_match.group(1))
+                if ref is None:
+                    raise ValueError("单元格缺少坐标属性")
+                style = self.STYLE_RE.search(cell_match.group(1))
+                cells[column_index_from_string(ref.group(1))] = (cell_match.group(0),
+                                                                  int(style.group(1)) if style else 0)
+
+            rows[int(row_number.group(1))] = (row_attrs, row_match.group(0), cells)
+
+        return {
+            "prefix": sheet_xml[:match.start()] + '<sheetData>',
+            "suffix": '</sheetData>' + sheet_xml[match.end():],
+            "rows": rows
+        }
+
+    def _drop_calc_chain(self):
+        """移除计算链并设置打开时完全重算，保证依赖写入单元格的公式结果正确"""
+        self.parts.pop('xl/calcChain.xml', None)
+        self.parts['[Content_Types].xml'] = re.sub(
+            rb'<Override[^>]*PartName="/xl/calcChain.xml"[^>]*/>', b'', self.parts['[Content_Types].xml'])
+        self.parts['xl/_rels/workbook.xml.rels'] = re.sub(
+            rb'<Relationship[^>]*Type="[^"]*/calcChain"[^>]*/>', b'', self.parts['xl/_rels/workbook.xml.rels'])
+
+        workbook_xml = self.parts['xl/workbook.xml']
+        if b'fullCalcOnLoad' not in workbook_xml:
+            if b'<calcPr' in workbook_xml:
+                workbook_xml = workbook_xml.replace(b'<calcPr', b'<calcPr fullCalcOnLoad="1"', 1)
+            else:
+                workbook_xml = workbook_xml.replace(b'</sheets>', b'</sheets><calcPr fullCalcOnLoad="1"/>', 1)
+        self.parts['xl/workbook.xml'] = workbook_xml
+
+    def _cell_xfs(self):
+        match = re.search(r'<cellXfs count="(\d+)">(.*?)</cellXfs>', self.styles_xml, re.S)
+        if match is None:
+            raise ValueError("styles.xml中没有cellXfs")
+        return match, self.XF_RE.findall(match.group(2))
+
+    def _add_fill_variant(self, key, build_base=True):
+        """为所有原始单元格样式生成使用指定填充的样式变体，返回{原样式: 变体样式}"""
+        fills = re.search(r'<fills count="(\d+)">(.*?)</fills>', self.styles_xml, re.S)
+        fill_id = int(fills.group(1))
+        self.styles_xml = (self.styles_xml[:fills.start()] + f'<fills count="{fill_id + 1}">'
+                           + fills.group(2) + key + '</fills>' + self.styles_xml[fills.end():])
+
+        xfs_match, xfs = self._cell_xfs()
+        first_variant = len(xfs)
+        variants = []
+        for xf in xfs[:self.base_xf_count]:
+            head, tail = split_start_tag(xf)
+            head = re.sub(r'\s(?:fillId|applyFill)="[^"]*"', '', head)
+            variants.append(f'{head} fillId="{fill_id}" applyFill="1"{tail}')
+
+        self.styles_xml = (self.styles_xml[:xfs_match.start()]
+                           + f'<cellXfs count="{first_variant + len(variants)}">'
+                           + ''.join(xfs) + ''.join(variants) + '</cellXfs>'
+                           + self.styles_xml[xfs_match.end():])
+        self.parts['xl/styles.xml'] = self.styles_xml.encode('utf-8')
+        self.fill_variants[key] = {base: first_variant + base for base in range(self.base_xf_count)}
+
+        if build_base:
+            self._build_base()
+        return self.fill_variants[key]
+
+    def _zip_options(self):
+        level = self.compression_level
+        return (ZIP_STORED if level == 0 else ZIP_DEFLATED), (level or None)
+
+    def _build_base(self):
+        """打包所有不需要逐报告生成的部件"""
+        method, level = self._zip_options()
+        excluded = {self.sheet_parts[index] for index in self.sheets}
+        buffer = io.BytesIO()
+        with ZipFile(buffer, 'w', method, allowZip64=True, compresslevel=level) as archive:
+            for name, data in self.parts.items():
+                if name not in excluded:
+                    archive.writestr(name, data)
+        self.base = buffer.getvalue()
+
+    def render_cell(self, row, col, value, style):
+        """按openpyxl的写法生成单元格XML"""
+        ref = f'{get_column_letter(col)}{row}'
+        style_attr = f' s="{style}"' if style else ''
+
+        if isinstance(value, bool):
+            return f'<c r="{ref}"{style_attr} t="b"><v>{int(value)}</v></c>'
+        if isinstance(value, (int, float)):
+            text = '' if math.isnan(value) or math.isinf(value) else '%.16g' % value
+            return f'<c r="{ref}"{style_attr} t="n"><v>{text}</v></c>'
+
+        text = str(value)
+        if text == '':
+            return f'<c r="{ref}"{style_attr} t="inlineStr"/>'
+        space = ' xml:space="preserve"' if text.strip() != text else ''
+        return f'<c r="{ref}"{style_attr} t="inlineStr"><is><t{space}>{xml_escape(text)}</t></is></c>'
+
+    def render_sheet(self, sheet, writes):
+        """生成工作表XML：未写入的行原样输出，写入的行按列合并模板单元格和新单元格"""
+        written_rows = {}
+        for (row, col), cell in writes.items():
+            written_rows.setdefault(row, {})[col] = cell
+
+        parts = [sheet['prefix']]
+        for row in sorted(set(sheet['rows']) | set(written_rows)):
+            template_row = sheet['rows'].get(row)
+            row_writes = written_rows.get(row)
+            if not row_writes:
+                parts.append(template_row[1])
+                continue
+
+            row_attrs, _, template_cells = template_row if template_row else (f' r="{row}"', None, {})
+            cells = {col: raw for col, (raw, _) in template_cells.items()}
+            for col, (value, fill) in row_writes.items():
+                style = template_cells[col][1] if col in template_cells else 0
+                if fill is not None:
+                    variants = self.fill_variants.get(fill) or self._add_fill_variant(fill)
+                    style = variants.get(style, style)
+                if value is KEEP_VALUE:
+                    # 只修改样式，保留模板单元格原有内容
+                    head, tail = split_start_tag(cells.get(col, f'<c r="{get_column_letter(col)}{row}"/>'))
+                    head = re.sub(r'\ss="\d+"', '', head)
+                    cells[col] = head + (f' s="{style}"' if style else '') + tail
+                else:
+                    cells[col] = self.render_cell(row, col, value, style)
+
+            parts.append(f'<row{self.SPANS_RE.sub("", row_attrs)}>'
+                         + ''.join(cells[col] for col in sorted(cells)) + '</row>')
+
+        parts.append(sheet['suffix'])
+        xml = ''.join(parts)
+
+        # 写入超出原有区域时更新dimension
+        if writes:
+            max_row = max(row for row, _ in writes)
+            max_col = max(col for _, col in writes)
+            dimension = self.DIMENSION_RE.search(xml)
+            if dimension and dimension.group(3):
+                end_col = column_index_from_string(dimension.group(3))
+                end_row = int(dimension.group(4))
+                if max_row > end_row or max_col > end_col:
+                    ref = (f'{dimension.group(1)}{dimension.group(2)}:'
+                           f'{get_column_letter(max(max_col, end_col))}{max(max_row, end_row)}')
+                    xml = xml[:dimension.start()] + f'<dimension ref="{ref}"/>' + xml[dimension.end():]
+
+        return xml.encode('utf-8')
+
+    def serialize(self, writes_by_sheet):
+        """在基础zip副本后追加重新生成的工作表XML，返回xlsx字节"""
+        method, level = self._zip_options()
+        sheet_xml = {index: self.render_sheet(sheet, writes_by_sheet.get(index, {}))
+                     for index, sheet in self.sheets.items()}
+
+        buffer = io.BytesIO(self.base)
+        with ZipFile(buffer, 'a', method, allowZip64=True, compresslevel=level) as archive:
+            for index, data in sheet_xml.items():
+                archive.writestr(self.sheet_parts[index], data)
+        return buffer.getvalue()
+
+
+class PatchCell:
+    """XML修补引擎的单元格代理 - 记录写入的值和填充"""
+
+    def __init__(self, writes, key):
+        self._writes = writes
+        self._key = key
+
+    @property
+    def value(self):
+        value = self._writes.get(self._key, (KEEP_VALUE, None))[0]
+        return None if value is KEEP_VALUE else value
+
+    @value.setter
+    def value(self, value):
+        self._writes[self._key] = (value, self._writes.get(self._key, (None, None))[1])
+
+    @property
+    def fill(self):
+        return self._writes.get(self._key, (None, None))[1]
+
+    @fill.setter
+    def fill(self, fill):
+        self._writes[self._key] = (self._writes.get(self._key, (KEEP_VALUE, None))[0], fill_key(fill))
+
+
+class PatchSheet:
+    """XML修补引擎的工作表代理 - 接口与openpyxl工作表的cell()写入一致"""
+
+    def __init__(self, title, index):
+        self.title = title
+        self.index = index
+        self.writes = {}
+
+    def cell(self, row, column, value=None):
+        cell = PatchCell(self.writes, (row, column))
+        if value is not None:
+            cell.value = value
+        return cell
+
+
+class PatchWorkbook:
+    """XML修补引擎的工作簿代理 - 保存时由XmlPatchTemplate生成xlsx"""
+
+    def __init__(self, package):
+        self.package = package
+        self.worksheets = [PatchSheet(title, index) for index, title in enumerate(package.sheet_titles)]
+
+    @property
+    def sheetnames(self):
+        return [sheet.title for sheet in self.worksheets]
+
+    def serialize(self):
+        return self.package.serialize({sheet.index: sheet.writes for sheet in self.worksheets if sheet.writes})
+
+
+def split_start_tag(element_xml):
+    """将元素XML拆分为开始标签（不含结尾的>或/>）和其余部分"""
+    end = element_xml.index('>')
+    if element_xml[end - 1] == '/':
+        return element_xml[:end - 1].rstrip(), element_xml[end - 1:]
+    return element_xml[:end], element_xml[end:]
+
+
+def fill_key(fill):
+    """填充样式的XML表示，用作样式变体的键"""
+    return tostring(fill.to_tree()).decode('utf-8')
+
+
+class BackgroundOutputWriter:
+    """🆕 后台输出写入线程 - 有界队列控制待写数据占用的内存，单线程时按提交顺序写入"""
+
+    def __init__(self, write_func, max_pending=4, logger=None, threads=1):
+        self.write_func = write_func
+        self.logger = logger or logging.getLogger(__name__)
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.failures = {}
+        self.threads = [threading.Thread(target=self._run, name=f"output-writer-{i}", daemon=True)
+                        for i in range(max(1, threads))]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, output_path, data):
+        """提交一个待写入的输出（队列满时阻塞）"""
+        self.queue.put((str(output_path), data))
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+
+            output_path, data = item
+            try:
+                self.write_func(output_path, data)
+                self.logger.debug(f"后台写入完成: {output_path}")
+            except Exception as e:
+                self.failures[output_path] = str(e)
+                self.logger.error(f"后台写入失败 {output_path}: {str(e)}")
+
+    def close(self):
+        """等待所有待写入的输出完成，返回写入失败的{输出路径: 错误信息}"""
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        return self.failures
+
+
+def _shard_worker(worker_id):
+    """本机分片进程入口"""
+    processor = SmartReportProcessor()
+    processor.config.SHARDING['worker_id'] = worker_id
+    processor.process_shard()
+
+
+_service_processor = None
+
+
+def _service_worker_init():
+    """转换服务工作进程初始化 - 创建处理器并预加载模板注册表"""
+    global _service_processor
+    _service_processor = SmartReportProcessor()
+    # 服务的输出随响应返回、不落盘，没有可增量更新的已有输出
+    _service_processor.config.DELTA_UPDATE = dict(_service_processor.config.DELTA_UPDATE, enable=False)
+    _service_processor.build_template_registry()
+
+
+def _service_convert(filename, data):
+    """转换服务工作进程任务 - 输出保存在内存中随结果返回"""
+    processor = _service_processor
+    processor.deferred_outputs = []
+    try:
+        result = processor.run_report_inline(Path(filename), processor.config.OUTPUT_DIR, data)
+        result['file'] = filename
+        result['groups'] = processor.last_group_counts if result['status'] == 'ok' else []
+        result['abnormal_count'] = sum(g['abnormal_count'] for g in result['groups'])
+        if result['status'] == 'ok' and processor.deferred_outputs:
+            result['workbook'] = processor.deferred_outputs[-1][1]
+        return result
+    finally:
+        processor.deferred_outputs = None
+
+
+def _isolated_report_worker(payload, file_path, output_dir, memory_limit_mb, conn):
+    """隔离子进程入口 - 按主进程传来的配置重建处理器，设置内存上限后处理单个报告，并通过管道回传结果"""
+    processor = SmartReportProcessor()
+    processor.config = payload['config']
+    processor.template_registry = payload['template_registry']
+    processor.retest_lots = payload['retest_lots']
+    if payload['defer_outputs']:
+        # 启用后台写入/归档时，输出回传给主进程写入，子进程只负责计算
+        processor.deferred_outputs = []
+
+    archive_log = next((h for h in logging.getLogger().handlers if h.get_name() == ARCHIVE_LOG_HANDLER), None)
+    if archive_log is None and payload['collect_log']:
+        # spawn方式启动的子进程没有继承主进程的归档日志处理器，单独收集本文件的日志
+        archive_log = logging.StreamHandler(io.StringIO())
+        archive_log.set_name(ARCHIVE_LOG_HANDLER)
+        archive_log.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+        logging.getLogger().addHandler(archive_log)
+    log_start = archive_log.stream.tell() if archive_log is not None else 0
+
+    def send(result):
+        if archive_log is not None:
+            result['log'] = archive_log.stream.getvalue()[log_start:]
+        conn.send(result)
+
+    try:
+        if memory_limit_mb and resource is not None:
+            limit = int(memory_limit_mb * 1024 * 1024)
+            resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+        ok = processor.process_report(file_path, output_dir)
+        send({**processor.report_status(ok),
+              "outputs": processor.deferred_outputs or [],
+              "statistics": processor.last_report_statistics if ok else None,
+              "spc": processor.last_report_spc if ok else None})
+    except MemoryError:
+        send({"status": "memory", "message": f"超出内存上限({memory_limit_mb}MB)"})
+    except Exception as e:
+        processor.logger.error(f"处理文件 {file_path.name} 时发生错误: {str(e)}")
+        processor.logger.exception("详细错误信息:")
+        send({"status": "error", "message": str(e), "traceback": traceback.format_exc()})
+    finally:
+        conn.close()
 
 
 def main():
     """主函数"""
+    parser = argparse.ArgumentParser(description="半导体可靠性测试数据自动导入报告")
+    parser.add_argument('--shard', action='store_true', help="分片模式：与其它实例通过共享工作目录认领源文件")
+    parser.add_argument('--worker-id', help="分片实例标识（默认: 主机名-进程号）")
+    parser.add_argument('--local-shards', type=int, metavar='N', help="在本机启动N个分片进程，结束后合并汇总")
+    parser.add_argument('--merge', action='store_true', help="合并分片工作目录中的各分片运行汇总")
+    parser.add_argument('--serve', action='store_true', help="启动常驻转换服务（配置见SERVICE）")
+    parser.add_argument('--screen', action='store_true', help="筛查模式：只统计异常数量，不生成报告")
+    parser.add_argument('--compare', nargs=2, metavar=('REFERENCE_DIR', 'CANDIDATE_DIR'),
+                        help="逐单元格对比两个输出目录（值、数值类型、填充），不一致时退出码为1")
+    parser.add_argument('--self-check', action='store_true',
+                        help="用当前配置重新生成样例报告并与参考输出对比，不一致时退出码为1")
+    parser.add_argument('--list-archive', metavar='ZIP', help="列出输出归档中的条目")
+    parser.add_argument('--extract-archive', metavar='ZIP', help="从输出归档中提取报告")
+    parser.add_argument('--entry', action='append', help="要提取的条目名（可多次指定，默认全部）")
+    parser.add_argument('--to', default='.', help="提取目标目录（默认当前目录）")
+    args = parser.parse_args()
+
+    # 归档读取不需要创建处理器
+    if args.list_archive:
+        for name, size in OutputArchive.list_entries(args.list_archive):
+            print(f"{size:>12}  {name}")
+        return
+    if args.extract_archive:
+        for path in OutputArchive.extract(args.extract_archive, args.to, args.entry):
+            print(path)
+        return
+
     processor = SmartReportProcessor()
-    processor.process_all_reports()
+    if args.worker_id:
+        processor.config.SHARDING['worker_id'] = args.worker_id
+
+    if args.compare:
+        sys.exit(0 if processor.compare_outputs(*args.compare) else 1)
+    elif args.self_check:
+        sys.exit(0 if processor.self_check() else 1)
+    elif args.serve:
+        processor.run_service()
+    elif args.screen:
+        processor.screen_all_reports()
+    elif args.local_shards:
+        processor.run_local_shards(args.local_shards)
+    elif args.shard:
+        processor.process_shard()
+    elif args.merge:
+        processor.merge_shard_summaries()
+    else:
+        processor.process_all_reports()
 
 
 if __name__ == "__main__":
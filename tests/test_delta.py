@@ -0,0 +1,116 @@
+"""增量更新测试 - 源文件追加样品后就地更新输出，结果与完整生成的黄金输出一致"""
+import sys
+from pathlib import Path
+
+import openpyxl
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from smart_processor import OutputComparator, SmartReportProcessor  # noqa: E402
+
+SOURCE_NAME = "2N7002H.xlsx"
+FIRST_SAMPLE_ROW = 29  # 源文件中F1所在行，共44个样品，每个数据组22个
+
+
+def make_processor(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    processor = SmartReportProcessor()
+    config = processor.config
+    config.TEMPLATE_DIR = str(ROOT / "templates")
+    config.OUTPUT_DIR = str(tmp_path / "output")
+    config.DELTA_UPDATE = dict(config.DELTA_UPDATE, enable=True)
+    processor.ensure_directories()
+    return processor
+
+
+def write_source(tmp_path, samples):
+    """源文件副本：少于44个样品时只保留前samples行（模拟测试进行中），多于44个时复制已有样品行追加"""
+    workbook = openpyxl.load_workbook(ROOT / "source_reports" / SOURCE_NAME)
+    sheet = workbook["Data"]
+    if samples < 44:
+        sheet.delete_rows(FIRST_SAMPLE_ROW + samples, 44 - samples)
+    for number in range(45, samples + 1):
+        values = [cell.value for cell in sheet[FIRST_SAMPLE_ROW + number - 45]]
+        sheet.append([f"F{number}"] + values[1:])
+    source = tmp_path / "source" / SOURCE_NAME
+    source.parent.mkdir(exist_ok=True)
+    workbook.save(source)
+    return source
+
+
+def track_delta_calls(processor, monkeypatch):
+    calls = []
+    apply_delta_rows = processor.apply_delta_rows
+
+    def tracked(*args):
+        calls.append(apply_delta_rows(*args))
+        return calls[-1]
+
+    monkeypatch.setattr(processor, "apply_delta_rows", tracked)
+    return calls
+
+
+def assert_same_outputs(processor, reference_dir, output_dir):
+    config = processor.config
+    comparator = OutputComparator(
+        {config.HIGHLIGHT_COLOR: "超限高亮", config.OVER_VALUE_HIGHLIGHT_COLOR: "Over高亮"},
+        file_pattern=f"processed_{Path(SOURCE_NAME).stem}.xlsx")
+    assert comparator.compare_dirs(Path(reference_dir), Path(output_dir)) == []
+    assert comparator.files_compared == 1
+
+
+def assert_matches_golden(processor, output_dir):
+    assert_same_outputs(processor, ROOT / "output", output_dir)
+
+
+def test_appended_samples_are_written_in_place(tmp_path, monkeypatch):
+    processor = make_processor(tmp_path, monkeypatch)
+    calls = track_delta_calls(processor, monkeypatch)
+    output_dir = tmp_path / "output"
+
+    # 两个数据组都已有样品：新增样品追加到第二组的空行
+    assert processor.process_report(write_source(tmp_path, 32), output_dir)
+    assert calls == []
+    assert processor.process_report(write_source(tmp_path, 44), output_dir)
+    assert calls == [True]
+    assert [g["samples"] for g in processor.last_group_counts] == [22]
+
+    assert_matches_golden(processor, output_dir)
+    # 状态文件放在缓存目录，输出目录只有报告
+    assert [p.name for p in output_dir.iterdir()] == [f"processed_{Path(SOURCE_NAME).stem}.xlsx"]
+    assert len(list((tmp_path / ".cache" / "delta").glob("*.json"))) == 1
+
+
+def test_unchanged_source_keeps_output(tmp_path, monkeypatch):
+    processor = make_processor(tmp_path, monkeypatch)
+    calls = track_delta_calls(processor, monkeypatch)
+    output_dir = tmp_path / "output"
+    source = write_source(tmp_path, 44)
+
+    assert processor.process_report(source, output_dir)
+    output_file = processor.get_output_path(source, output_dir)
+    before = output_file.stat().st_mtime_ns
+    assert processor.process_report(source, output_dir)
+
+    assert calls == [True]
+    assert output_file.stat().st_mtime_ns == before
+    assert_matches_golden(processor, output_dir)
+
+
+def test_new_group_falls_back_to_full_report(tmp_path, monkeypatch):
+    processor = make_processor(tmp_path, monkeypatch)
+    calls = track_delta_calls(processor, monkeypatch)
+    output_dir = tmp_path / "output"
+
+    # 模板的两个数据组工作表已写满，新增样品需要克隆第三个工作表，回退为完整生成
+    assert processor.process_report(write_source(tmp_path, 44), output_dir)
+    source = write_source(tmp_path, 50)
+    assert processor.process_report(source, output_dir)
+    assert calls == [None]
+    assert [g["samples"] for g in processor.last_group_counts] == [22, 22, 6]
+
+    processor.config.DELTA_UPDATE = dict(processor.config.DELTA_UPDATE, enable=False)
+    (tmp_path / "full").mkdir()
+    assert processor.process_report(source, tmp_path / "full")
+    assert_same_outputs(processor, tmp_path / "full", output_dir)
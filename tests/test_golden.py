@@ -0,0 +1,90 @@
+"""黄金输出回归测试 - 用当前代码重新生成样例报告，与仓库中的output/逐单元格对比"""
+import sys
+import zipfile
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from smart_processor import OutputComparator, SmartReportProcessor  # noqa: E402
+
+
+def make_processor(tmp_path, monkeypatch, **sections):
+    """在临时目录中创建处理器（日志和工作文件不写入仓库），sections按键合并到对应的配置项"""
+    monkeypatch.chdir(tmp_path)
+    processor = SmartReportProcessor()
+    config = processor.config
+    config.SOURCE_DIR = str(ROOT / "source_reports")
+    config.TEMPLATE_DIR = str(ROOT / "templates")
+    config.OUTPUT_DIR = str(tmp_path / "output")
+    config.OUTPUT_ARCHIVE = dict(config.OUTPUT_ARCHIVE, enable=False)
+    for name, values in sections.items():
+        setattr(config, name, dict(getattr(config, name), **values))
+    processor.ensure_directories()
+    return processor
+
+
+def assert_matches_golden(processor, output_dir):
+    config = processor.config
+    comparator = OutputComparator(
+        {config.HIGHLIGHT_COLOR: "超限高亮", config.OVER_VALUE_HIGHLIGHT_COLOR: "Over高亮"},
+        float_tolerance=config.GOLDEN_CHECK.get('float_tolerance', 0.0),
+        file_pattern=config.GOLDEN_CHECK.get('file_pattern', 'processed_*.xlsx'))
+    mismatches = comparator.compare_dirs(ROOT / "output", Path(output_dir))
+
+    assert comparator.files_compared == len(list((ROOT / "output").glob("processed_*.xlsx")))
+    assert mismatches == []
+
+
+def run_batch(processor):
+    results = processor.process_all_reports()
+    assert results, "没有生成任何报告"
+    assert [(r['file'], r['message']) for r in results if r['status'] != 'ok'] == []
+    return results
+
+
+SPAWN = {"isolate_files": True, "isolation_start_method": "spawn"}
+
+# 输出必须与引擎、流水线、后台写入和子进程启动方式无关
+# Windows只有spawn：子进程参数需要可序列化，进度统计（含锁）和后台写入线程不能随之传递
+GOLDEN_VARIANTS = {
+    "default": {},
+    "xml_patch": {"OUTPUT_WRITING": {"engine": "xml_patch"}},
+    "pipeline": {"PIPELINE": {"enable": True}},
+    "pipeline_xml_patch": {"PIPELINE": {"enable": True}, "OUTPUT_WRITING": {"engine": "xml_patch"}},
+    "background_writer": {"OUTPUT_WRITING": {"background_writer": True}},
+    "inline_background_writer": {"ERROR_HANDLING": {"isolate_files": False},
+                                 "OUTPUT_WRITING": {"background_writer": True}},
+    "spawn_progress": {"ERROR_HANDLING": SPAWN, "SCHEDULING": {"progress": True}},
+    "spawn_background_writer": {"ERROR_HANDLING": SPAWN, "OUTPUT_WRITING": {"background_writer": True}},
+    "spawn_xml_patch": {"ERROR_HANDLING": SPAWN, "OUTPUT_WRITING": {"engine": "xml_patch"}},
+}
+
+
+@pytest.mark.parametrize("sections", GOLDEN_VARIANTS.values(), ids=GOLDEN_VARIANTS.keys())
+def test_outputs_match_golden(tmp_path, monkeypatch, sections):
+    processor = make_processor(tmp_path, monkeypatch, **sections)
+    run_batch(processor)
+    assert_matches_golden(processor, tmp_path / "output")
+
+
+def test_spawn_isolation_with_archive(tmp_path, monkeypatch):
+    processor = make_processor(tmp_path, monkeypatch, ERROR_HANDLING=SPAWN,
+                               OUTPUT_ARCHIVE={"enable": True, "include_log": True})
+    run_batch(processor)
+
+    assert not list((tmp_path / "output").glob("processed_*.xlsx")), "归档模式下报告不应写入输出目录"
+    extracted = tmp_path / "extracted"
+    logs = []
+    for archive_path in sorted((tmp_path / "output").glob("*.zip")):
+        with zipfile.ZipFile(archive_path) as archive:
+            for name in archive.namelist():
+                if name.startswith("processed_"):
+                    archive.extract(name, extracted)
+                elif name.endswith(".log"):
+                    logs.append(archive.read(name).decode("utf-8"))
+    assert_matches_golden(processor, extracted)
+    # spawn子进程的日志同样收集到归档日志中
+    assert "".join(logs).count("开始处理") == len(list((ROOT / "source_reports").glob("*.xlsx")))
@@ -0,0 +1,68 @@
+"""复测合并分组测试 - 按文件名归入批次、批次内排序和输出文件名"""
+import os
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from smart_processor import SmartReportProcessor  # noqa: E402
+
+
+def make_processor(tmp_path, monkeypatch, enable=True, **retest_merge):
+    monkeypatch.chdir(tmp_path)
+    processor = SmartReportProcessor()
+    processor.config.RETEST_MERGE = dict(processor.config.RETEST_MERGE, enable=enable, **retest_merge)
+    return processor
+
+
+def make_files(tmp_path, names_by_mtime):
+    """按给定顺序创建源文件，修改时间依次递增"""
+    files = []
+    for offset, name in enumerate(names_by_mtime):
+        path = tmp_path / name
+        path.write_bytes(b"")
+        os.utime(path, (1_700_000_000 + offset, 1_700_000_000 + offset))
+        files.append(path)
+    return files
+
+
+def test_disabled_keeps_files_unchanged(tmp_path, monkeypatch):
+    processor = make_processor(tmp_path, monkeypatch, enable=False)
+    files = make_files(tmp_path, ["A.xlsx", "A_retest.xlsx"])
+
+    assert processor.group_retest_files(files) == files
+    assert processor.retest_lots == {}
+
+
+def test_groups_by_lot_in_mtime_order(tmp_path, monkeypatch):
+    processor = make_processor(tmp_path, monkeypatch)
+    # 复测文件名排在前面，但修改时间更晚
+    a_rt2, a, b, a_retest = make_files(tmp_path, ["A-RT2.xlsx", "A.xlsx", "B.xlsx", "A_retest.xlsx"])
+    os.utime(a, (1_600_000_000, 1_600_000_000))
+
+    lead_files = processor.group_retest_files([a_rt2, a, b, a_retest])
+
+    assert lead_files == [a, b]
+    assert processor.retest_lots == {a: {"lot": "A", "files": [a, a_rt2, a_retest]}}
+    assert processor.get_output_path(a, tmp_path / "output") == tmp_path / "output" / "processed_A.xlsx"
+    assert processor.get_output_path(b, tmp_path / "output") == tmp_path / "output" / "processed_B.xlsx"
+
+
+def test_groups_in_name_order(tmp_path, monkeypatch):
+    processor = make_processor(tmp_path, monkeypatch, order_by="name")
+    a_retest, a_rt2, a = make_files(tmp_path, ["A_retest.xlsx", "A-RT2.xlsx", "A.xlsx"])
+
+    assert processor.group_retest_files([a_retest, a_rt2, a]) == [a_rt2]
+    assert processor.retest_lots[a_rt2]["files"] == [a_rt2, a, a_retest]
+
+
+def test_lot_pattern_is_case_insensitive(tmp_path, monkeypatch):
+    processor = make_processor(tmp_path, monkeypatch)
+    lot, retest, other = make_files(tmp_path, ["DP900N10D.xlsx", "DP900N10D_Retest2.xlsx", "DP900N10E.xlsx"])
+
+    assert processor.group_retest_files([lot, retest, other]) == [lot, other]
+    assert processor.retest_lots[lot]["files"] == [lot, retest]
+    # 重新分组时清空上一次的批次记录
+    processor.group_retest_files([other])
+    assert processor.retest_lots == {}
@@ -0,0 +1,75 @@
+"""分片认领测试 - 认领、回收失去心跳的认领，以及只释放本实例的认领"""
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from smart_processor import ClaimHeartbeat, SmartReportProcessor  # noqa: E402
+
+
+def make_processor(tmp_path, monkeypatch, stale_after=120):
+    monkeypatch.chdir(tmp_path)
+    processor = SmartReportProcessor()
+    processor.config.SHARDING = dict(processor.config.SHARDING, work_dir=str(tmp_path / "work"),
+                                     stale_after_seconds=stale_after)
+    return processor, processor.get_shard_dirs()['claims']
+
+
+def make_stale(claim_path, age=600):
+    past = time.time() - age
+    os.utime(claim_path, (past, past))
+
+
+def test_claim_is_exclusive(tmp_path, monkeypatch):
+    processor, claims = make_processor(tmp_path, monkeypatch)
+    claim_path = claims / "a.xlsx.claim"
+
+    assert processor.try_claim(claim_path, "w1")
+    assert not processor.try_claim(claim_path, "w2")
+    assert ClaimHeartbeat.read_owner(claim_path) == "w1"
+
+
+def test_stale_claim_is_reclaimed(tmp_path, monkeypatch):
+    processor, claims = make_processor(tmp_path, monkeypatch, stale_after=60)
+    claim_path = claims / "a.xlsx.claim"
+    processor.try_claim(claim_path, "w1")
+    make_stale(claim_path)
+
+    assert processor.try_claim(claim_path, "w2")
+    assert ClaimHeartbeat.read_owner(claim_path) == "w2"
+    assert [p.name for p in claims.iterdir()] == [claim_path.name]
+
+
+def test_release_keeps_claim_reclaimed_by_other_worker(tmp_path, monkeypatch):
+    processor, claims = make_processor(tmp_path, monkeypatch, stale_after=60)
+    claim_path = claims / "a.xlsx.claim"
+    processor.try_claim(claim_path, "w1")
+    make_stale(claim_path)
+    processor.try_claim(claim_path, "w2")
+
+    # 停顿后恢复的w1结束时不能删除w2的有效认领
+    processor.release_claim(claim_path, "w1")
+    assert ClaimHeartbeat.read_owner(claim_path) == "w2"
+    assert not processor.try_claim(claim_path, "w3")
+
+    processor.release_claim(claim_path, "w2")
+    assert not claim_path.exists()
+    assert list(claims.iterdir()) == []
+
+
+def test_heartbeat_stops_after_ownership_lost(tmp_path):
+    claim_path = tmp_path / "a.xlsx.claim"
+    claim_path.write_text(json.dumps({"worker": "w1"}), encoding='utf-8')
+    heartbeat = ClaimHeartbeat(claim_path, "w1", 0.05)
+    try:
+        claim_path.write_text(json.dumps({"worker": "w2"}), encoding='utf-8')
+        make_stale(claim_path)
+        heartbeat.thread.join(2)
+        assert heartbeat.lost
+        assert time.time() - claim_path.stat().st_mtime > 300
+    finally:
+        heartbeat.stop()
@@ -0,0 +1,60 @@
+"""SPC累加器测试 - 分批累加后合并的结果与一次累加全部数值一致"""
+import math
+import statistics
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from smart_processor import SmartReportProcessor, SpcAccumulator  # noqa: E402
+
+VALUES = [1.25, 3.5, -0.75, 2.0, 8.125, 4.5, 4.5, 0.0, 6.25, -2.5]
+
+
+def make_accumulator(values, over=0, out_of_limit=0):
+    accumulator = SpcAccumulator("BVDSS", "ID=250uA", lsl=-1.0, usl=7.0)
+    accumulator.add_values(values)
+    accumulator.over = over
+    accumulator.out_of_limit = out_of_limit
+    return accumulator
+
+
+def assert_same_statistics(actual, expected):
+    assert actual.count == expected.count
+    assert math.isclose(actual.mean, expected.mean, rel_tol=1e-12, abs_tol=1e-12)
+    assert math.isclose(actual.m2, expected.m2, rel_tol=1e-12, abs_tol=1e-12)
+    assert (actual.minimum, actual.maximum) == (expected.minimum, expected.maximum)
+    assert (actual.over, actual.out_of_limit) == (expected.over, expected.out_of_limit)
+
+
+def test_merge_matches_single_accumulator():
+    merged = make_accumulator(VALUES[:3], over=1)
+    merged.merge(make_accumulator(VALUES[3:7], out_of_limit=2))
+    merged.merge(make_accumulator(VALUES[7:], over=1, out_of_limit=1))
+
+    assert_same_statistics(merged, make_accumulator(VALUES, over=2, out_of_limit=3))
+    assert math.isclose(merged.std(), statistics.stdev(VALUES), rel_tol=1e-12)
+
+
+def test_merge_with_empty_accumulator():
+    # 空累加器（某个工作进程没有该测试项的数值）不影响结果，且可作为合并的起点
+    merged = make_accumulator([], over=1)
+    merged.merge(make_accumulator(VALUES))
+    merged.merge(make_accumulator([]))
+
+    assert_same_statistics(merged, make_accumulator(VALUES, over=1))
+
+
+def test_dict_round_trip_and_merge_spc_statistics():
+    first, second = make_accumulator(VALUES[:4]), make_accumulator(VALUES[4:], over=3)
+    restored = SpcAccumulator.from_dict(first.to_dict())
+    assert restored.summary() == first.summary()
+
+    merged = SmartReportProcessor.merge_spc_statistics([
+        {"BVDSS|ID=250uA": first.to_dict()},
+        {"BVDSS|ID=250uA": second.to_dict(), "VTH|": make_accumulator([1.0]).to_dict()},
+    ])
+    assert sorted(merged) == ["BVDSS|ID=250uA", "VTH|"]
+    assert_same_statistics(merged["BVDSS|ID=250uA"], make_accumulator(VALUES, over=3))
+    assert merged["VTH|"].count == 1